@@ -69,7 +69,9 @@ class Coil:
         self.odw = odw
         self.odwc = odwc if odwc is not None else odw
         self.wt = winding_thickness
+        self.pf = pf
         self.n = nmax
+        self.explicit_n = explicit_n
 
         self.lc = lc
         self.idc = idc
@@ -0,0 +1,457 @@
+import argparse
+import concurrent.futures
+import hashlib
+import hmac
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import secrets
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Every message is a pickled tuple prefixed with its length in bytes.
+# Pickle is used so that sensors, Helmholtz arrays and callables travel unchanged. As unpickling can run code,
+# both ends first prove knowledge of a shared authkey (see _handshake) and nothing is unpickled before that.
+HEADER = struct.Struct('!I')
+
+AUTHKEY_ENV = 'PYWINDING_AUTHKEY'
+NONCE_SIZE = 32
+HANDSHAKE_TIMEOUT = 10.0    # seconds a new connection has to authenticate
+
+HEARTBEAT_INTERVAL = 2.0    # seconds between worker heartbeats
+HEARTBEAT_TIMEOUT = 10.0    # seconds of silence before a worker is considered lost
+
+
+def _authkey(authkey):
+    # The shared secret given explicitly, else taken from the environment
+    authkey = authkey if authkey is not None else os.environ.get(AUTHKEY_ENV)
+    if authkey is None:
+        return None
+    return authkey.encode() if isinstance(authkey, str) else bytes(authkey)
+
+
+def _handshake(sock, authkey, role):
+    """
+    Mutual HMAC challenge-response over raw bytes. Each end sends a random nonce and answers the other's nonce
+    with HMAC(authkey, role + nonce); the role stops a reply being reflected back to its sender.
+    Raises ConnectionError if the other end does not know the authkey.
+    """
+    other = b'worker' if role == b'coordinator' else b'coordinator'
+    nonce = secrets.token_bytes(NONCE_SIZE)
+    sock.settimeout(HANDSHAKE_TIMEOUT)
+    try:
+        sock.sendall(nonce)
+        challenge = _recv_exact(sock, NONCE_SIZE)
+        if challenge is None:
+            raise ConnectionError('connection closed during authentication')
+        sock.sendall(hmac.new(authkey, role + challenge, hashlib.sha256).digest())
+        answer = _recv_exact(sock, hashlib.sha256().digest_size)
+        if answer is None or not hmac.compare_digest(answer, hmac.new(authkey, other + nonce, hashlib.sha256).digest()):
+            raise ConnectionError('authentication failed')
+    finally:
+        sock.settimeout(None)
+
+
+def _send(sock, lock, msg):
+    data = pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)
+    with lock:
+        sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv(sock):
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exact(sock, HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return pickle.loads(data)
+
+
+class _Job:
+    def __init__(self, job_id, fn, args, kwargs):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = concurrent.futures.Future()
+        self.worker = None
+        self.stealing = False
+
+
+class _Connection:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.send_lock = threading.Lock()
+        self.slots = 0
+        self.name = None
+        self.assigned = []          # job ids in assignment order, started or queued on the worker
+        self.last_seen = time.time()
+        self.alive = True
+
+
+class Coordinator(concurrent.futures.Executor):
+    """
+    Executor that dispatches simulation jobs to pywinding workers over TCP.
+
+    host, port : address to listen on for workers (port 0 picks a free port, see self.address)
+    authkey : secret shared with the workers, taken from the PYWINDING_AUTHKEY environment variable if not given.
+    If neither is set a random key is generated, see self.authkey. Connections that do not know the key are refused.
+    heartbeat_timeout : seconds without a message before a worker is dropped and its jobs re-queued
+    prefetch : number of extra jobs queued on each worker beyond its slots, so that it never waits on the network
+
+    Workers are started on each host with:
+        python -m pywinding.Distributed --host <coordinator host> --port <coordinator port> --authkey <authkey>
+
+    Results are streamed back as they complete through the futures returned by submit(),
+    so concurrent.futures.as_completed() can be used to consume them.
+    Idle workers steal queued jobs that have not yet started from the busiest worker.
+    Testbench_B_Sweep recognises the coordinator as a remote executor and ships job descriptions
+    (sensor, Helmholtz array and problem settings) instead of .fem files.
+    """
+    remote = True
+
+    def __init__(self, host='127.0.0.1', port=0, authkey=None, heartbeat_timeout=HEARTBEAT_TIMEOUT, prefetch=1):
+        self.authkey = _authkey(authkey) or secrets.token_hex(16).encode()
+        self.heartbeat_timeout = heartbeat_timeout
+        self.prefetch = prefetch
+        self.__server = socket.create_server((host, port))
+        self.address = self.__server.getsockname()[:2]
+        self.__cond = threading.Condition()
+        self.__ids = itertools.count()
+        self.__pending = deque()
+        self.__jobs = {}
+        self.__workers = []
+        self.__shutdown = False
+
+        threading.Thread(target=self.__accept, daemon=True).start()
+        threading.Thread(target=self.__monitor, daemon=True).start()
+        logging.info(f"Coordinator listening on {self.address[0]}:{self.address[1]}")
+
+    @property
+    def workers(self):
+        with self.__cond:
+            return [(w.name, w.slots) for w in self.__workers if w.alive and w.slots]
+
+    @property
+    def max_workers(self):
+        """Total number of jobs the connected workers run at once"""
+        with self.__cond:
+            return sum(w.slots for w in self.__workers if w.alive)
+
+    def wait_for_workers(self, n=1, timeout=None):
+        """Block until at least n workers have connected, returns False on timeout."""
+        with self.__cond:
+            return self.__cond.wait_for(lambda: len([w for w in self.__workers if w.slots]) >= n, timeout)
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self.__cond:
+            if self.__shutdown:
+                raise RuntimeError('cannot schedule new jobs after shutdown')
+            job = _Job(next(self.__ids), fn, args, kwargs)
+            self.__jobs[job.id] = job
+            self.__pending.append(job.id)
+            self.__assign()
+        return job.future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.__cond:
+            self.__shutdown = True
+            if cancel_futures:
+                while self.__pending:
+                    self.__jobs.pop(self.__pending.popleft()).future.cancel()
+            futures = [job.future for job in self.__jobs.values()]
+        if wait:
+            concurrent.futures.wait(futures)
+        with self.__cond:
+            for worker in self.__workers:
+                try:
+                    _send(worker.sock, worker.send_lock, ('stop',))
+                except OSError:
+                    pass
+            self.__workers = []
+        self.__server.close()
+
+    def __accept(self):
+        while True:
+            try:
+                sock, address = self.__server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.__serve, args=(_Connection(sock, address),), daemon=True).start()
+
+    def __serve(self, worker):
+        try:
+            _handshake(worker.sock, self.authkey, b'coordinator')
+        except OSError as e:
+            logging.warning(f"Refused connection from {worker.address[0]}:{worker.address[1]}: {e}")
+            worker.sock.close()
+            return
+        with self.__cond:
+            if self.__shutdown:
+                worker.sock.close()
+                return
+            self.__workers.append(worker)
+        try:
+            while True:
+                msg = _recv(worker.sock)
+                if msg is None:
+                    break
+                with self.__cond:
+                    worker.last_seen = time.time()
+                    self.__handle(worker, msg)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logging.info(f"Lost connection to worker {worker.name}: {e}")
+        finally:
+            with self.__cond:
+                self.__drop(worker)
+
+    def __handle(self, worker, msg):
+        kind = msg[0]
+        if kind == 'hello':
+            worker.slots, worker.name = msg[1], msg[2]
+            logging.info(f"Worker {worker.name} connected with {worker.slots} slots")
+            self.__cond.notify_all()
+        elif kind == 'result':
+            _, job_id, ok, value = msg
+            job = self.__jobs.get(job_id)
+            if job is None or job.worker is not worker:
+                # A late result of a worker that was dropped, the job has been re-queued and its new owner will report it
+                logging.debug(f"Ignoring result of job {job_id} from {worker.name}, which no longer holds it")
+                return
+            worker.assigned.remove(job_id)
+            del self.__jobs[job_id]
+            if not job.future.done():
+                if ok:
+                    job.future.set_result(value)
+                else:
+                    job.future.set_exception(value)
+        elif kind == 'stolen':
+            _, job_id, ok = msg
+            job = self.__jobs.get(job_id)
+            if job is not None:
+                job.stealing = False
+                if ok and job_id in worker.assigned:
+                    worker.assigned.remove(job_id)
+                    job.worker = None
+                    self.__pending.appendleft(job_id)
+        # heartbeats only refresh worker.last_seen
+        self.__assign()
+
+    def __drop(self, worker):
+        if not worker.alive:
+            return
+        worker.alive = False
+        logging.info(f"Worker {worker.name} disconnected, re-queueing {len(worker.assigned)} jobs")
+        try:
+            worker.sock.close()
+        except OSError:
+            pass
+        if worker in self.__workers:
+            self.__workers.remove(worker)
+        # Re-queue everything the lost worker held, started or not
+        for job_id in reversed(worker.assigned):
+            job = self.__jobs.get(job_id)
+            if job is not None:
+                job.worker = None
+                job.stealing = False
+                self.__pending.appendleft(job_id)
+        worker.assigned = []
+        self.__assign()
+
+    def __assign(self):
+        # Called with the lock held. Hand out pending jobs to workers with spare capacity,
+        # least loaded first, then let idle workers steal queued jobs from busy ones.
+        workers = [w for w in self.__workers if w.alive and w.slots]
+        while self.__pending and workers:
+            worker = min(workers, key=lambda w: len(w.assigned) / w.slots)
+            if len(worker.assigned) >= worker.slots + self.prefetch:
+                break
+            job = self.__jobs.get(self.__pending.popleft())
+            if job is None:
+                continue
+            try:
+                _send(worker.sock, worker.send_lock, ('job', job.id, job.fn, job.args, job.kwargs))
+            except OSError:
+                self.__pending.appendleft(job.id)
+                workers.remove(worker)
+                continue
+            except Exception as e:
+                # The job itself could not be pickled
+                self.__jobs.pop(job.id)
+                job.future.set_exception(e)
+                continue
+            job.worker = worker
+            worker.assigned.append(job.id)
+
+        if self.__pending:
+            return
+        for thief in [w for w in workers if len(w.assigned) < w.slots]:
+            victims = [w for w in workers if len(w.assigned) > w.slots]
+            if not victims:
+                break
+            victim = max(victims, key=lambda w: len(w.assigned) - w.slots)
+            job_id = next((j for j in reversed(victim.assigned) if j in self.__jobs and not self.__jobs[j].stealing), None)
+            if job_id is None:
+                continue
+            self.__jobs[job_id].stealing = True
+            logging.debug(f"Worker {thief.name} stealing job {job_id} from {victim.name}")
+            try:
+                _send(victim.sock, victim.send_lock, ('steal', job_id))
+            except OSError:
+                self.__jobs[job_id].stealing = False
+
+    def __monitor(self):
+        while not self.__shutdown:
+            time.sleep(self.heartbeat_timeout / 4)
+            now = time.time()
+            with self.__cond:
+                for worker in list(self.__workers):
+                    if worker.slots and now - worker.last_seen > self.heartbeat_timeout:
+                        logging.warning(f"Worker {worker.name} missed its heartbeat")
+                        self.__drop(worker)
+
+
+class Worker:
+    """
+    Connects to a Coordinator and runs the jobs it sends in a local process pool.
+    Each job runs in its own process as FEMM only supports one session per process.
+    If a solver process dies the pool is replaced, so a crash only fails the job that caused it.
+    """
+    def __init__(self, host, port, slots=None, authkey=None, heartbeat=HEARTBEAT_INTERVAL):
+        self.host = host
+        self.port = port
+        self.authkey = _authkey(authkey)
+        if self.authkey is None:
+            raise ValueError(f'An authkey shared with the coordinator is required, pass it or set {AUTHKEY_ENV}')
+        self.slots = slots or os.cpu_count()
+        self.heartbeat = heartbeat
+        self.__cond = threading.Condition()
+        self.__queue = deque()
+        self.__stop = False
+
+    def serve(self):
+        self.__sock = socket.create_connection((self.host, self.port))
+        self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _handshake(self.__sock, self.authkey, b'worker')
+        self.__send_lock = threading.Lock()
+        _send(self.__sock, self.__send_lock, ('hello', self.slots, f"{socket.gethostname()}:{os.getpid()}"))
+
+        self.__pool_lock = threading.Lock()
+        self.__pool = self.__new_pool()
+        threads = [threading.Thread(target=self.__beat, daemon=True)]
+        threads += [threading.Thread(target=self.__run, daemon=True) for _ in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        try:
+            self.__receive()
+        finally:
+            with self.__cond:
+                self.__stop = True
+                self.__queue.clear()
+                self.__cond.notify_all()
+            self.__sock.close()
+            with self.__pool_lock:
+                pool = self.__pool
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def __new_pool(self, max_workers=None):
+        # Spawn rather than fork so solver processes do not inherit the coordinator socket,
+        # which would keep the connection open if this worker dies.
+        context = multiprocessing.get_context('spawn')
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or self.slots, mp_context=context)
+
+    def __execute(self, fn, args, kwargs):
+        # A solver process that dies (e.g. a FEMM crash) breaks the whole pool, failing every job running in it.
+        # Replace the pool so later jobs are unaffected, and re-run the job in a process of its own:
+        # a job that breaks that process too is the one that crashed, and only its failure is reported.
+        with self.__pool_lock:
+            pool = self.__pool
+        try:
+            return pool.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool:
+            with self.__pool_lock:
+                if self.__pool is pool:
+                    logging.warning("A solver process died, restarting the process pool")
+                    pool.shutdown(wait=False)
+                    self.__pool = self.__new_pool()
+        with self.__new_pool(1) as isolated:
+            return isolated.submit(fn, *args, **kwargs).result()
+
+    def __receive(self):
+        while True:
+            msg = _recv(self.__sock)
+            if msg is None or msg[0] == 'stop':
+                return
+            if msg[0] == 'job':
+                with self.__cond:
+                    self.__queue.append(msg[1:])
+                    self.__cond.notify()
+            elif msg[0] == 'steal':
+                with self.__cond:
+                    job = next((j for j in self.__queue if j[0] == msg[1]), None)
+                    if job is not None:
+                        self.__queue.remove(job)
+                _send(self.__sock, self.__send_lock, ('stolen', msg[1], job is not None))
+
+    def __beat(self):
+        while not self.__stop:
+            time.sleep(self.heartbeat)
+            try:
+                _send(self.__sock, self.__send_lock, ('heartbeat',))
+            except OSError:
+                return
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: self.__queue or self.__stop)
+                if self.__stop:
+                    return
+                job_id, fn, args, kwargs = self.__queue.popleft()
+            try:
+                msg = ('result', job_id, True, self.__execute(fn, args, kwargs))
+            except Exception as e:
+                msg = ('result', job_id, False, e)
+            try:
+                try:
+                    _send(self.__sock, self.__send_lock, msg)
+                except (pickle.PicklingError, TypeError, AttributeError) as e:
+                    _send(self.__sock, self.__send_lock, ('result', job_id, False, RuntimeError(repr(e))))
+            except OSError:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pywinding simulation worker')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the coordinator')
+    parser.add_argument('--port', type=int, required=True, help='port of the coordinator')
+    parser.add_argument('--slots', type=int, default=None, help='number of parallel FEMM processes (default: all cores)')
+    parser.add_argument('--authkey', default=None, help=f'secret shared with the coordinator (default: ${AUTHKEY_ENV})')
+    args = parser.parse_args()
+    # Import through the package rather than using this __main__ copy, so that only one copy of the module is loaded
+    from pywinding.Distributed import Worker
+    Worker(args.host, args.port, args.slots, args.authkey).serve()
+
+
+if __name__ == "__main__":
+    main()
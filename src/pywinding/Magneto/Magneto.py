@@ -1,4 +1,3 @@
-import femm
 import logging
 
 from .commands import *
@@ -9,6 +8,8 @@ class Magneto:
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~
     """
     def __init__(self):
+        # Imported on first use so that importing pywinding does not start the ActiveX client
+        import femm
         self.__api = femm
         logging.info("PyFEMM API wrapper instanciated")
  
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+
+
+# Solve times of previous runs are kept here so that predictions improve from run to run
+HISTORY_PATH = 'temp/solve_times.json'
+HISTORY_LENGTH = 2000
+
+# Prior weights of the cost model, used until enough history has been recorded.
+# log(seconds) = w . [1, log10(domain / smallest feature), permeable core, log(1 + turns), L/R extraction, log(1 + field map points)]
+PRIOR_WEIGHTS = np.array([0.0, 0.5, 1.0, 0.05, 0.7, 0.1])
+PRIOR_STRENGTH = 1.0
+
+
+def max_workers(executor):
+    """
+    Number of jobs the executor runs at once, e.g. the process count of a pool or the total slots of a Coordinator
+    """
+    return getattr(executor, 'max_workers', None) or getattr(executor, '_max_workers', None) or os.cpu_count() or 1
+
+
+class Scheduler:
+    """
+    Cost-aware job scheduler.
+    Predicts the solve time of each job from its geometry, core material and the solve times recorded in history_path,
+    and submits the longest jobs first (longest processing time first), so that a sweep does not end on a long tail
+    of a single permeable core solve. The makespan of each dispatch is compared against the ideal makespan,
+    max(total solve time / workers, longest solve), and accumulated per run.
+
+    history_path : JSON file of previous solve times, None keeps the history in memory only
+    """
+    def __init__(self, history_path=HISTORY_PATH):
+        self.history_path = history_path
+        self.history = []
+        if history_path is not None and os.path.isfile(history_path):
+            try:
+                with open(history_path) as f:
+                    self.history = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.info(f"Ignoring unreadable solve time history {history_path}: {e}")
+        self.__fit()
+        self.begin()
+
+    @staticmethod
+    def features(sen, kind='run', points=0):
+        """
+        Feature vector of a job solving coil sen. kind is 'run' for a single solve or 'characterise' for a solve
+        followed by L/R extraction, points is the number of field map points sampled from the solution.
+        """
+        # The problem spans the Helmholtz array, 100x the (length+diameter) of the sensor, and is meshed down to its smallest region
+        domain = 100 * (sen.ls + sen.ods)
+        smallest = min(v for v in (sen.ls, (sen.ods - sen.ids) / 2, (sen.odc - sen.idc) / 2, sen.odw) if v > 0)
+        return np.array([
+            1.0,
+            np.log10(domain / smallest),
+            float(sen.ma != 'Air'),
+            np.log1p(sen.n),
+            float(kind == 'characterise'),
+            np.log1p(points),
+        ])
+
+    def predict(self, sen, kind='run', points=0):
+        """Predicted solve time in seconds"""
+        f = self.features(sen, kind, points)
+        return float(np.exp(f @ self.__weights + self.__material.get(sen.ma, 0.0)))
+
+    def record(self, sen, kind, points, seconds):
+        self.history.append({'material': sen.ma, 'features': self.features(sen, kind, points).tolist(), 'seconds': seconds})
+
+    def save(self):
+        self.history = self.history[-HISTORY_LENGTH:]
+        if self.history_path is None:
+            return
+        directory = os.path.dirname(self.history_path)
+        if directory and not os.path.isdir(directory):
+            os.mkdir(directory)
+        with open(self.history_path, 'w') as f:
+            json.dump(self.history, f)
+
+    def __fit(self):
+        # Ridge regression of log(seconds) towards the prior weights, then a per-material correction
+        # from the mean residual of each core material, shrunk towards zero for rarely seen materials.
+        records = [r for r in self.history[-HISTORY_LENGTH:] if r['seconds'] > 0]
+        self.__weights = PRIOR_WEIGHTS.copy()
+        self.__material = {}
+        if not records:
+            return
+        X = np.array([r['features'] for r in records])
+        y = np.log([r['seconds'] for r in records])
+        A = X.T @ X + PRIOR_STRENGTH * np.eye(len(PRIOR_WEIGHTS))
+        self.__weights = np.linalg.solve(A, X.T @ y + PRIOR_STRENGTH * PRIOR_WEIGHTS)
+        residuals = y - X @ self.__weights
+        for ma in set(r['material'] for r in records):
+            mask = np.array([r['material'] == ma for r in records])
+            self.__material[ma] = float(np.sum(residuals[mask]) / (np.sum(mask) + 1))
+
+    def begin(self):
+        """Starts a new run, makespans of the following dispatches are accumulated until the next call."""
+        self.makespan = 0.0
+        self.makespan_ideal = 0.0
+
+    def dispatch(self, executor, jobs, tasks, desc='Simulation Progress'):
+        """
+        Submits (function, args) jobs to the executor, longest predicted first, and returns their results in the order given.
+        tasks holds the (sensor, kind, points) of each job used to predict and record its solve time.
+        Each job must return a result dict with the time it took under 'time'.
+        """
+        from tqdm import tqdm
+        costs = [self.predict(*task) for task in tasks]
+        order = sorted(range(len(jobs)), key=lambda i: -costs[i])
+
+        start = time.perf_counter()
+        futures = {}
+        for i in order:
+            fn, args = jobs[i]
+            futures[executor.submit(fn, *args)] = i
+        print("WAITING FOR SIMULATION PROCESSES TO COMPLETE...")
+        pbar = tqdm(total=len(futures), desc=desc)
+        for _ in as_completed(futures):
+            pbar.update(n=1)  # Increments counter
+        pbar.close()
+        makespan = time.perf_counter() - start
+
+        results = [None] * len(jobs)
+        for future, i in futures.items():
+            results[i] = future.result()
+        times = [r['time'] for r in results]
+        for task, seconds in zip(tasks, times):
+            self.record(*task, seconds)
+        self.save()
+        self.__fit()
+
+        ideal = max(sum(times) / max_workers(executor), max(times)) if times else 0.0
+        self.makespan += makespan
+        self.makespan_ideal += ideal
+        if makespan > 0:
+            print(f"MAKESPAN {makespan:.2f} s, IDEAL {ideal:.2f} s ({100 * ideal / makespan:.0f}% EFFICIENT)")
+
+        return results
@@ -0,0 +1,254 @@
+"""
+Module level solve functions executed by the pool and remote worker processes.
+Only imports what is needed to build and solve a FEMM problem, so that each worker process
+that unpickles a job does not pay for the plotting, saving and formatting dependencies of the testbench.
+"""
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .Magneto import Magneto
+
+
+path_prefix = 'temp/'
+
+
+def create_filename(sen, helm):
+    sim_file_name = f"{sen.na}_{sen.ma}_sensor_{str(helm.B)}_T_{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}_{np.random.rand()}.fem"
+    sim_file_name = sim_file_name.replace(" ", "")
+    sim_file_name = sim_file_name.replace(":", "")
+
+    return f"{path_prefix}{sim_file_name}"
+
+
+def draw(simulator, sim_objs, path, sim_kwargs):
+    """
+    Builds the FEMM problem for the given sensor and Helmholtz objects and saves it to path
+    """
+    simulator.init(hide=True, **sim_kwargs)
+
+    ## Block Labels
+    # Add block labels at the label coordinates for the sensor winding and core
+    # Define these first avoids a bug
+    for obj in sim_objs:
+        obj._label(simulator)
+    for obj in sim_objs:
+        obj._draw(simulator)
+    ## Boundary Conditions
+    # Create Boundary Conditions
+    simulator.mi.makeABC()
+    simulator.mi.zoomnatural()
+
+    ## Materials
+    # Add materials for AIR used in simulation
+    simulator.mi.getmaterial( 'Air' )
+    for obj in sim_objs:
+        simulator.mi.addmaterial( * obj.material )
+    for obj in sim_objs:
+        obj._properties( simulator )
+
+    simulator.mi.zoomnatural()
+
+    simulator.mi.saveas( path )
+    simulator.closefemm()
+
+
+def solve( sen, helm, sim_kwargs, field_grid=None ):
+    """
+    Draws and runs a single problem from its description, used by remote workers
+    which do not share the coordinator's temp directory.
+    The problem and solution files are deleted once read, so that workers do not accumulate them.
+    """
+    start = time.perf_counter()
+    path = draw_problem(sen, helm, sim_kwargs)
+    try:
+        result = run(sen, path, field_grid)
+    finally:
+        remove_problem(path)
+    result['time'] = time.perf_counter() - start
+
+    return result
+
+
+def draw_problem( sen, helm, sim_kwargs ):
+    """
+    Draws the problem of a sensor in a Helmholtz array into a new file in the temp directory, returns its path
+    """
+    if not os.path.isdir("temp"):
+        os.mkdir("temp")
+    path = create_filename(sen, helm)
+    draw(Magneto(), (sen, helm), path, sim_kwargs)
+
+    return path
+
+
+def remove_problem( path ):
+    """
+    Deletes the problem at path with its solution and the files of its L/R extraction
+    """
+    stem = os.path.splitext(path)[0]
+    for file in (path, f"{stem}.ans", f"{stem}_LR.fem", f"{stem}_LR.ans"):
+        try:
+            if os.path.isfile(file):
+                os.remove(file)
+        except OSError as e:
+            logging.info(f"Error deleting {file}: {e}")
+
+
+def run( sen, path, field_grid=None ):
+    """
+    Run method moved to module level to allow for multiprocessing
+    field_grid : optional (r, z) tuple of 1D coordinate arrays (millimetres), the field is sampled
+    at every combination of r and z from the open solution and returned under 'field'
+    The time taken is returned under 'time' (seconds) for the cost model of the scheduler.
+    """
+    start = time.perf_counter()
+    simulator = Magneto()
+    simulator.openfemm(True)
+
+    simulator.opendocument(path)
+
+    simulator.mi.analyze()
+    simulator.mi.loadsolution()
+    simulator.mo.zoomnatural()
+
+    simulator.mo.selectblock(sen.lacr, sen.lacz)
+    core_volume  = simulator.mo.blockintegral(10)
+    Bz_avg_vol   = simulator.mo.blockintegral(9)
+    B_Field_Core = np.abs(Bz_avg_vol/core_volume)
+
+    sensor_vals = simulator.mo.getcircuitproperties('icoil_sensor')
+    V_sensor = abs(sensor_vals[1])
+
+    result = {
+        'B'     : B_Field_Core,
+        'V'     : V_sensor,
+        'path'  : path   
+    }
+    if field_grid is not None:
+        result['field'] = field_map(simulator, path, *field_grid)
+    
+    simulator.closefemm()
+    result['time'] = time.perf_counter() - start
+    
+    return result
+
+
+
+# Lua 4 chunk run inside FEMM by field_map. Samples every (r, z) combination of the grid tables with mo_getpointvalues
+# and writes the real and imaginary parts of A, B1 and B2 of each point as a line of the output file, z outer and r inner.
+# Points outside the problem are written as nan.
+FIELD_MAP_LUA = (
+    "local r, z = {%s}, {%s} "
+    "local h = openfile('%s', 'w') "
+    "for i = 1, getn(z) do for j = 1, getn(r) do "
+    "local A, B1, B2 = mo_getpointvalues(r[j], z[i]) "
+    "if A then write(h, format('%%.17g %%.17g %%.17g %%.17g %%.17g %%.17g\\\\n', Re(A), Im(A), Re(B1), Im(B1), Re(B2), Im(B2))) "
+    "else write(h, 'nan nan nan nan nan nan\\\\n') end "
+    "end end "
+    "closefile(h)"
+)
+
+
+def field_map( simulator, path, r, z ):
+    """
+    Samples the solution open in the simulator's postprocessor at every (r, z) combination of the 1D arrays r and z (millimetres),
+    r >= 0 as checked by the testbench before the sweep is dispatched.
+    The grid is sampled by a single Lua loop inside FEMM, one ActiveX call per solution rather than one per point,
+    which writes the values next to the problem file path.
+    Returns arrays of shape (len(z), len(r)): the complex phasors of the vector potential 'A' and the flux density
+    components 'Br' and 'Bz', and the flux density magnitude 'B' (tesla). Points outside the problem are NaN.
+    """
+    r = np.atleast_1d(np.asarray(r, dtype=float))
+    z = np.atleast_1d(np.asarray(z, dtype=float))
+
+    # FEMM does not share the working directory of this process, so the file is given by its absolute path
+    out = os.path.abspath(f"{os.path.splitext(path)[0]}_field.txt").replace('\\', '/')
+    chunk = FIELD_MAP_LUA % (','.join(map(repr, r.tolist())), ','.join(map(repr, z.tolist())), out)
+    # dostring makes the chunk a single expression, as the ActiveX interface evaluates the command it is given
+    simulator.callfemm(f'dostring("{chunk}")')
+    values = np.loadtxt(out, ndmin=2).reshape(len(z), len(r), 6)
+    os.remove(out)
+
+    A  = values[..., 0] + 1j * values[..., 1]
+    Br = values[..., 2] + 1j * values[..., 3]
+    Bz = values[..., 4] + 1j * values[..., 5]
+
+    return {
+        'r'     : r,
+        'z'     : z,
+        'A'     : A,
+        'Br'    : Br,
+        'Bz'    : Bz,
+        'B'     : np.sqrt(np.abs(Br)**2 + np.abs(Bz)**2)
+    }
+
+
+def extract( path, f, odwc ):
+    """
+    Re-solves the problem at path with the transmitter off and a small sensor current
+    and returns the resistance (ohms) and inductance (henries) of the sensor winding.
+    The modified problem is saved alongside path so that extractions can run in parallel.
+    """
+    simulator = Magneto()
+    simulator.openfemm(True)
+    simulator.opendocument(path)
+
+    # Set the current of the sensor to a small value (1uA)
+    i_sensor = 1e-6
+    # Turn off the transmitter current (0A) so that no external field is
+    # applied
+    i_transmitter = 0
+
+    simulator.mi.modifycircprop('icoil_transmitter', 1, i_transmitter)
+    simulator.mi.modifycircprop('icoil_sensor', 1, i_sensor)
+    simulator.mi.addmaterial('Sensor',1,1,0,0,58,0,0,1,3,0,0,1,odwc)
+
+    simulator.mi.saveas(f"{os.path.splitext(path)[0]}_LR.fem")
+    simulator.mi.analyze()
+    simulator.mi.loadsolution()
+
+    sensor_vals = simulator.mo.getcircuitproperties('icoil_sensor')
+    R = np.real(sensor_vals[1])/i_sensor
+    L = np.imag(sensor_vals[1])/(2*np.pi*f*i_sensor)
+
+    simulator.mi.close()
+    simulator.mo.close()
+    simulator.closefemm()
+
+    return R, L
+
+
+def extract_lr( sen, helm, sim_kwargs ):
+    """
+    Draws a single problem from its description and extracts the L and R parameters of its sensor,
+    used by remote workers. Its files are deleted once read.
+    """
+    start = time.perf_counter()
+    path = draw_problem(sen, helm, sim_kwargs)
+    try:
+        R, L = extract(path, helm.f, sen.odwc)
+    finally:
+        remove_problem(path)
+
+    return {'R': R, 'L': L, 'time': time.perf_counter() - start}
+
+
+def characterise( sen, helm, sim_kwargs ):
+    """
+    Solves a single design from its description and extracts its L and R parameters in the same process,
+    used where every job is a different coil, e.g. tolerance analysis. Its files are deleted once read.
+    """
+    start = time.perf_counter()
+    path = draw_problem(sen, helm, sim_kwargs)
+    try:
+        result = run(sen, path)
+        result['R'], result['L'] = extract(path, helm.f, sen.odwc)
+    finally:
+        remove_problem(path)
+    result['time'] = time.perf_counter() - start
+
+    return result
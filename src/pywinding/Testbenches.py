@@ -1,24 +1,17 @@
 from .Magneto import Magneto
 import numpy as np
 import os
+import logging
 import concurrent.futures
-from concurrent.futures import as_completed
-from tqdm import tqdm
 from .Helmholtz import Helmholtz
 import copy
-from scipy.io import savemat
 from datetime import datetime
 from .Utility import cleanup
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from sciform import Formatter
-from .Utility import cleanup
-mpl.rcParams['axes.formatter.useoffset'] = False
-
+from .Solver import create_filename, draw, extract, extract_lr, run, solve
+from .Scheduler import Scheduler, HISTORY_PATH
 
-sform = Formatter(
-    round_mode="sig_fig", exp_mode="engineering", ndigits=6
-)
+# Plotting (matplotlib), saving (scipy.io), formatting (sciform) and progress (tqdm) dependencies
+# are imported where they are used, keeping `import pywinding` and worker start-up fast.
 
 
 # Default settings for generating FEMM .fem magnetic problems.
@@ -30,33 +23,100 @@ SIM_DEFAULTS = {
     'ang_cons'  :   30              # angular constraint
 }
 
-path_prefix = 'temp/'
-
 # A testbench class to perform a magnitude sweep of a user defined coil design
 # If no initialisers are provided by the user then the default stimulus frequency is 1000 Hz and evaluates the sensor over three flux density levels between 1 and 3 uT
+# spacing : 'linear' or 'log' spacing of the num_points flux densities, 'log' suits sweeps spanning several decades
+# adaptive : if True the sweep is refined after the initial points, adding flux densities where the sensitivity or
+# effective permeability changes fastest or departs from linear interpolation between its neighbours
+# max_points : the total number of flux densities the adaptive sweep may solve (defaults to 4 x num_points)
+# refine_tol : intervals whose change or departure from linear interpolation is below this fraction of the largest value are not refined
+# refine_batch : flux densities added per refinement round, each round is solved in parallel (defaults to half the CPU cores)
+# history_path : file of recorded solve times used to submit the longest jobs first, None keeps them in memory only
 class Testbench_B_Sweep():
-    def __init__(self, freq=1e3, B_start=1e-6, B_end=3e-6, num_points=3, **kwargs):
-        self.__simulator = Magneto()
+    def __init__(self, freq=1e3, B_start=1e-6, B_end=3e-6, num_points=3, spacing='linear', adaptive=False,
+                 max_points=None, refine_tol=0.01, refine_batch=None, history_path=HISTORY_PATH, **kwargs):
+        if spacing not in ('linear', 'log'):
+            raise ValueError("spacing must be 'linear' or 'log'")
+        if spacing == 'log' and min(B_start, B_end) <= 0:
+            logging.error(f'Log spaced sweep from {B_start} T to {B_end} T must only contain positive flux densities')
+            raise ValueError('Log spaced sweeps require positive flux densities')
+        # FEMM is started on first use, so that sweeps run entirely by remote workers do not need it on this host
+        self.__simulator = None
         self.freq = freq
         self.num_points = num_points
-        self.Bs = np.linspace(B_start, B_end, num_points)
+        self.spacing = spacing
+        if spacing == 'log':
+            self.Bs = np.geomspace(B_start, B_end, num_points)
+        else:
+            self.Bs = np.linspace(B_start, B_end, num_points)
+        self.adaptive = adaptive
+        self.max_points = max_points or 4 * num_points
+        self.refine_tol = refine_tol
+        self.refine_batch = refine_batch or max(1, (os.cpu_count() or 2) // 2)
         self.cleanup = cleanup
+        self.scheduler = Scheduler(history_path)
         # Default settings for FEMM problems
         self.__sim_kwargs = {**{'freq' : self.freq}, **{k : kwargs.get(k, v) for k,v in SIM_DEFAULTS.items()}}
         self.path = None
         self.results = None
+        self.batch_results = None
         if not os.path.isdir("temp"):
             os.mkdir("temp")
 
-    def __create_filename(self, sen, helm):
-        sim_file_name = f"{sen.na}_{sen.ma}_sensor_{str(helm.B)}_T_{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}_{np.random.rand()}.fem"
-        sim_file_name = sim_file_name.replace(" ", "")
-        sim_file_name = sim_file_name.replace(":", "")
+    def simulate(self, sen, clean_up_femm=True, executor=None, field_grid=None):
+        """
+        executor : a concurrent.futures executor used to run the solves, e.g. a pywinding.Distributed.Coordinator.
+        If None a process pool using all available CPU cores of this machine is used.
+        field_grid : optional (r, z) tuple of 1D coordinate arrays (millimetres). The field of every solution is sampled
+        on this grid by the worker that solved it and returned as arrays of shape (num_points, len(z), len(r)).
+        """
+        return self.simulate_batch([sen], clean_up_femm, executor, field_grid)[0]
+
+    def simulate_batch(self, sens, clean_up_femm=True, executor=None, field_grid=None):
+        """
+        Sweeps several coils together. The solves of all coils share each dispatch, so the scheduler orders
+        them longest first across coils. Returns a list with the results of each coil, also kept in self.batch_results,
+        while self.results holds the results of the last coil.
+        """
+        # Check the field grid before anything is drawn or dispatched, rather than in each worker after its solve
+        if field_grid is not None:
+            field_grid = tuple(np.atleast_1d(np.asarray(c, dtype=float)) for c in field_grid)
+            if not all(np.all(np.isfinite(c)) for c in field_grid):
+                logging.error(f'Field map coordinates r: {field_grid[0]} z: {field_grid[1]} must be finite')
+                raise ValueError('Field map coordinates must be finite')
+            if np.any(field_grid[0] < 0):
+                logging.error(f'Field map radii from {field_grid[0].min()} mm must be non-negative in an axisymmetric problem')
+                raise ValueError('Field map radii must be non-negative in an axisymmetric problem')
+
+        if executor is None:
+            #########################################################
+            # Distribute the simulations to different processes on the machine
+            # All available CPU cores will be used by default.
+            with concurrent.futures.ProcessPoolExecutor(max_workers=None) as executor:
+                return self.simulate_batch(sens, clean_up_femm, executor, field_grid)
+
+        self.scheduler.begin()
+        remote = getattr(executor, 'remote', False)
+        sweeps = [self.__prepare(sen, remote) for sen in sens]
+
+        print(f'GENERATING FEMM SWEEP FROM {self.Bs[0]} T to {self.Bs[-1]} T over {len(self.Bs)} points at {self.freq} Hz\n')
+        self.__sweep(executor, sweeps, [self.Bs] * len(sweeps), field_grid)
+        if self.adaptive:
+            self.__refine(executor, sweeps, field_grid)
+
+        if remote:
+            self.__extract_remote(executor, sweeps)
+
+        print("SIMULATION COMPLETE")
+        self.batch_results = [self.__collect(sweep, field_grid) for sweep in sweeps]
+        self.results = self.batch_results[-1]
 
-        return f"{path_prefix}{sim_file_name}"
+        if clean_up_femm is True:
+            cleanup()
 
-    def simulate(self, sen, clean_up_femm=True):
+        return self.batch_results
 
+    def __prepare(self, sen, remote=False):
         # build Helmholtz for given test flux density at a scale of 100x the (length+diameter) of the sensor.
         helm = Helmholtz(100 * (sen.ls + sen.ods), self.Bs[0], self.freq, 5, 1 )
 
@@ -67,76 +127,57 @@ class Testbench_B_Sweep():
         sensor_air.ma = 'Air'
         sensor_core.ma = sen.ma
 
-        # Create initial .fem files for air and cored sensors
-        self.__sim_objs = (sensor_air , helm)
-        path_air =  self.__draw()
-        self.__sim_objs = (sensor_core, helm)
-        path_core = self.__draw()
-        
-        path_airs  = [path_air]
-        path_cores = [path_core]
-
-        ## Create Simulation Files
-        print(f'GENERATING FEMM SWEEP FROM {self.Bs[0]} T to {self.Bs[-1]} T over {len(self.Bs)} points at {self.freq} Hz\n')
-        # Duplicate the .fem files for air and cored sensors, creating an addition two .fem files for each field amplitude being simulated.
-        print("STARTED GENERATING SIMULATION FILES")
-        if len(self.Bs) > 1:
-            for sensor, path, paths in zip([sensor_air, sensor_core], [path_air, path_core], [path_airs, path_cores]):
-                self.__simulator.openfemm(True)
-                self.__simulator.opendocument(str(path))
-                for j, B in enumerate(self.Bs[1:]):
-
-                    helm = Helmholtz( 100 * (sen.ls + sen.ods), B, self.freq, 5, 1 )
-                    self.__simulator.mi.modifycircprop('icoil_transmitter', 1, helm.i)
-
-
-                    sim_file_name = self.__create_filename(sen, helm)
-                    self.__simulator.mi.saveas(sim_file_name)
-                    paths.append(str(sim_file_name))
-                
-                self.__simulator.closefemm()
-        print("FINISHED GENERATING SIMULATION FILES")
-
-        print("ASSIGNING SIMULATION FILES TO PROCESSES")
+        # Create initial .fem files for air and cored sensors, remote workers draw their own
+        path_air = path_core = None
+        if not remote:
+            self.__sim_objs = (sensor_air , helm)
+            path_air =  self.__draw()
+            self.__sim_objs = (sensor_core, helm)
+            path_core = self.__draw()
+
+        return {
+            'sen'           : sen,
+            'helm'          : helm,
+            'sensor_air'    : sensor_air,
+            'sensor_core'   : sensor_core,
+            'path_air'      : path_air,
+            'path_core'     : path_core,
+            'Bs'            : np.array([]),
+            'results_air'   : [],
+            'results_core'  : []
+        }
 
-        #########################################################
-        # Distribute the simulations to different processes on the machine
-        # All available CPU cores will be used by default.
-        with concurrent.futures.ProcessPoolExecutor(max_workers=None) as executor:
-            # A list to store futures for data parsing
-            futures_processes = []
-            for path_air, path_core in zip(path_airs, path_cores):
-               futures_processes.append(executor.submit(run,  sensor_air,  path_air ))
-               futures_processes.append(executor.submit(run,  sensor_core, path_core))
-            print("WAITING FOR SIMULATION PROCESSES TO COMPLETE...")
-            pbar = tqdm(total=self.num_points * 2, desc='Simulation Progress')  # Init pbar  # Increments counter
-            for _ in as_completed(futures_processes):
-                pbar.update(n=1)  # Increments counter
-        pbar.close()
+    def __collect(self, sweep, field_grid=None):
+        sen = sweep['sen']
+        results_air, results_core = sweep['results_air'], sweep['results_core']
+        path_airs  = [r['path'] for r in results_air]
+        path_cores = [r['path'] for r in results_core]
 
-        print("SIMULATION COMPLETE")
-        futures_air =  futures_processes[0::2]
-        futures_core = futures_processes[1::2]
         #########################################################
         # PARSE
         print("EXTRACTING FIELD RESULTS...", end='')
-        B_air =  np.array([f.result()['B'] for f in futures_air])
-        B_core = np.array([f.result()['B'] for f in futures_core])
-        v_air =  np.array([f.result()['V'] for f in futures_air])
-        v_core = np.array([f.result()['V'] for f in futures_core])
+        B_air =  np.array([r['B'] for r in results_air])
+        B_core = np.array([r['B'] for r in results_core])
+        v_air =  np.array([r['V'] for r in results_air])
+        v_core = np.array([r['V'] for r in results_core])
         # Calculate the sensitivity (in V per T per Hz) and the effective relative magnetic permeabilty of the coil at each operating con
         sensitivity = v_core / (B_air * self.freq)
         mu_eff = B_core / B_air
         print("DONE")
 
-        print("EXTRACTING COIL LR PARAMETERS...", end='')
-        # Performance a circuit analysis of the sensor in order to extract L and R parameters
-        LR_PARAMS = self.__extract(path_air, path_core, self.freq, sen.odwc)
-        print("DONE")
+        if 'LR_PARAMS' in sweep:
+            # Already extracted by the remote workers
+            LR_PARAMS = sweep['LR_PARAMS']
+        else:
+            print("EXTRACTING COIL LR PARAMETERS...", end='')
+            # Performance a circuit analysis of the sensor in order to extract L and R parameters
+            LR_PARAMS = self.__extract(sweep['path_air'], sweep['path_core'], self.freq, sen.odwc)
+            print("DONE")
 
         # Results structure contains raw values as well as means.
-        self.results = {
+        results = {
             'Name'              : sen.na,
+            'B_applied'         : sweep['Bs'],
             'V'                 : v_core,
             'B'                 : B_air,
             'Rair'              : LR_PARAMS['resistance_air'],
@@ -150,92 +191,172 @@ class Testbench_B_Sweep():
             'mu_eff_mean'       : np.mean(mu_eff),
             'mu_eff_std'        : np.std(mu_eff),
             'paths_air'          : path_airs,
-            'paths_core'         : path_cores
+            'paths_core'         : path_cores,
+            'makespan'          : self.scheduler.makespan,
+            'makespan_ideal'    : self.scheduler.makespan_ideal
         }
+        if field_grid is not None:
+            # Field maps stacked over the sweep, indexed [point, z, r]
+            results.update({'field_r' : field_grid[0], 'field_z' : field_grid[1]})
+            for ma, ma_results in zip(['air', 'core'], [results_air, results_core]):
+                for k in ['A', 'Br', 'Bz', 'B']:
+                    results[f'field_{k}_{ma}'] = np.array([r['field'][k] for r in ma_results])
 
-        if clean_up_femm is True:
-            cleanup()
-
-        return self.results
+        return results
 
     def save_results(self):
         if self.results is not None:
+            from scipy.io import savemat
             save_path = self.results['Name'] + f"_T_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.mat"
             print("\nSAVING RESULTS TO", save_path)
             savemat(save_path, self.results)
         else:
             print("No results saved, need to run simulation first.")
 
-    def __draw(self):
+    def __sweep(self, executor, sweeps, Bs_list, field_grid=None):
+        # Solves the air and cored sensors of each sweep at its flux densities in Bs_list within a single dispatch,
+        # and appends the flux densities and their run() results to the sweep
+        points = 0 if field_grid is None else len(field_grid[0]) * len(field_grid[1])
+        jobs, tasks, owners = [], [], []
+        if not getattr(executor, 'remote', False):
+            print("STARTED GENERATING SIMULATION FILES")
+        for sweep, Bs in zip(sweeps, Bs_list):
+            if len(Bs) == 0:
+                continue
+            sen, sensor_air, sensor_core = sweep['sen'], sweep['sensor_air'], sweep['sensor_core']
+            owners.append((sweep, Bs, len(jobs)))
+            helms = [Helmholtz( 100 * (sen.ls + sen.ods), B, self.freq, 5, 1 ) for B in Bs]
+            if getattr(executor, 'remote', False):
+                # Remote workers draw each problem themselves from its description, so no .fem files are generated
+                # locally or sent over the network and this host does not need FEMM.
+                for helm in helms:
+                    jobs.append((solve, (sensor_air,  helm, self.__sim_kwargs, field_grid)))
+                    jobs.append((solve, (sensor_core, helm, self.__sim_kwargs, field_grid)))
+            else:
+                simulator = self.__femm()
+                path_airs  = []
+                path_cores = []
+
+                ## Create Simulation Files
+                # Duplicate the .fem files for air and cored sensors, creating an addition two .fem files for each field amplitude being simulated.
+                # The initial .fem files already hold the first flux density of the sweep. They are reused for that
+                # point only, every other point gets its own file even if its flux density is the same.
+                first = len(sweep['Bs']) == 0
+                for sensor, path, paths in zip([sensor_air, sensor_core], [sweep['path_air'], sweep['path_core']], [path_airs, path_cores]):
+                    opened = False
+                    for i, helm in enumerate(helms):
+                        if first and i == 0:
+                            paths.append(path)
+                            continue
+                        if not opened:
+                            simulator.openfemm(True)
+                            simulator.opendocument(str(path))
+                            opened = True
+                        simulator.mi.modifycircprop('icoil_transmitter', 1, helm.i)
+
+                        sim_file_name = create_filename(sen, helm)
+                        simulator.mi.saveas(sim_file_name)
+                        paths.append(str(sim_file_name))
+
+                    if opened:
+                        simulator.closefemm()
+
+                for path_air, path_core in zip(path_airs, path_cores):
+                    jobs.append((run, (sensor_air,  path_air,  field_grid)))
+                    jobs.append((run, (sensor_core, path_core, field_grid)))
+            tasks += [(sensor_air, 'run', points), (sensor_core, 'run', points)] * len(Bs)
+        if not getattr(executor, 'remote', False):
+            print("FINISHED GENERATING SIMULATION FILES")
 
-        self.__simulator.init(hide=True, **self.__sim_kwargs)
-
-        ## Block Labels
-        # Add block labels at the label coordinates for the sensor winding and core
-        # Define these first avoids a bug
-        for obj in self.__sim_objs:
-            obj._label(self.__simulator)
-        for obj in self.__sim_objs:
-            obj._draw(self.__simulator)
-        ## Boundary Conditions
-        # Create Boundary Conditions
-        self.__simulator.mi.makeABC()
-        self.__simulator.mi.zoomnatural()
-
-        ## Materials
-        # Add materials for AIR used in simulation
-        self.__simulator.mi.getmaterial( 'Air' )
-        for obj in self.__sim_objs:
-            self.__simulator.mi.addmaterial( * obj.material )
-        for obj in self.__sim_objs:
-            obj._properties( self.__simulator )
-        
-        self.__simulator.mi.zoomnatural()
-        
-        path = self.__create_filename( *self.__sim_objs )
-        self.__simulator.mi.saveas( path )
-        self.__simulator.closefemm()
-        
+        print("ASSIGNING SIMULATION FILES TO PROCESSES")
+        results = self.scheduler.dispatch(executor, jobs, tasks)
+        for sweep, Bs, start in owners:
+            sweep_results = results[start:start + 2 * len(Bs)]
+            sweep['Bs'] = np.concatenate([sweep['Bs'], Bs])
+            sweep['results_air']  += sweep_results[0::2]
+            sweep['results_core'] += sweep_results[1::2]
+
+    def __refine(self, executor, sweeps, field_grid=None):
+        # Adaptively adds flux densities to the sweeps until no interval needs refinement or max_points is reached.
+        # The refinements of all coils in a round are solved in one dispatch. Leaves each sweep sorted by flux density.
+        rounds = 0
+        while True:
+            Bs_list = [self.__refinements(sweep) for sweep in sweeps]
+            num_new = sum(len(Bs) for Bs in Bs_list)
+            if num_new == 0:
+                break
+            rounds += 1
+            print(f"REFINEMENT ROUND {rounds}: ADDING {num_new} POINTS (UP TO {self.max_points} PER COIL)")
+            self.__sweep(executor, sweeps, Bs_list, field_grid)
+        for sweep in sweeps:
+            self.__sort(sweep)
+
+    def __refinements(self, sweep):
+        # Returns the flux densities bisecting the intervals of the sweep most in need of refinement, within its budget
+        self.__sort(sweep)
+        Bs = sweep['Bs']
+        B_air = np.array([r['B'] for r in sweep['results_air']])
+        sensitivity = np.array([r['V'] for r in sweep['results_core']]) / (B_air * self.freq)
+        mu_eff = np.array([r['B'] for r in sweep['results_core']]) / B_air
+
+        # Refine in log(B) for log spaced sweeps so that every decade is treated alike
+        x = np.log(Bs) if self.spacing == 'log' else Bs
+        x_new = refinement_points(x, [sensitivity, mu_eff], self.refine_tol, self.refine_batch, self.max_points)
+        return np.exp(x_new) if self.spacing == 'log' else x_new
+
+    @staticmethod
+    def __sort(sweep):
+        order = np.argsort(sweep['Bs'])
+        sweep['Bs'] = sweep['Bs'][order]
+        sweep['results_air']  = [sweep['results_air'][i]  for i in order]
+        sweep['results_core'] = [sweep['results_core'][i] for i in order]
+
+    def __femm(self):
+        if self.__simulator is None:
+            self.__simulator = Magneto()
+        return self.__simulator
+
+    def __draw(self):
+        path = create_filename( *self.__sim_objs )
+        draw(self.__femm(), self.__sim_objs, path, self.__sim_kwargs)
         return path
+
+    def __extract_remote(self, executor, sweeps):
+        # Dispatches the L/R extraction of the air and cored sensors of every sweep to the remote workers,
+        # each drawing its problem at the first flux density of the sweep from its description
+        print("EXTRACTING COIL LR PARAMETERS ON THE WORKERS")
+        jobs, tasks = [], []
+        for sweep in sweeps:
+            for sensor in (sweep['sensor_air'], sweep['sensor_core']):
+                jobs.append((extract_lr, (sensor, sweep['helm'], self.__sim_kwargs)))
+                tasks.append((sensor, 'run', 0))
+        results = self.scheduler.dispatch(executor, jobs, tasks, desc='Extraction Progress')
+        for sweep, air, core in zip(sweeps, results[0::2], results[1::2]):
+            sweep['LR_PARAMS'] = {
+                'resistance_air'    : air['R'],
+                'inductance_air'    : air['L'],
+                'resistance_core'   : core['R'],
+                'inductance_core'   : core['L'],
+            }
+
     # Opens up all the resulting .ans files and extracts the simulated magnetic and circuit parameters
     def __extract(self, path_air, path_core, f, odwc):
         parameters = {}
         for ma, path in zip( ['air', 'core'], [path_air, path_core]):
-            self.__simulator.openfemm(True)
-            self.__simulator.opendocument(path)
-            
-            # Set the current of the sensor to a small value (1uA)
-            i_sensor = 1e-6
-            # Turn off the transmitter current (0A) so that no external field is
-            # applied
-            i_transmitter = 0
-
-            self.__simulator.mi.modifycircprop('icoil_transmitter', 1, i_transmitter)
-            self.__simulator.mi.modifycircprop('icoil_sensor', 1, i_sensor)
-            self.__simulator.mi.addmaterial('Sensor',1,1,0,0,58,0,0,1,3,0,0,1,odwc)
-
-
-            self.__simulator.mi.saveas('temp.fem')
-            self.__simulator.mi.analyze()
-            self.__simulator.mi.loadsolution()
-            
-            sensor_vals = self.__simulator.mo.getcircuitproperties('icoil_sensor')
-            R = np.real(sensor_vals[1])/i_sensor
-            L = np.imag(sensor_vals[1])/(2*np.pi*f*i_sensor)
-
+            R, L = extract(path, f, odwc)
             parameters.update({
                 f'resistance_{ma}' : R,
                 f'inductance_{ma}' : L
             })
-            self.__simulator.mi.close()
-            self.__simulator.mo.close()
-
-        self.__simulator.closefemm()
 
         return parameters
 
     def print_results(self):
         if self.results is not None:
+            from sciform import Formatter
+            sform = Formatter(
+                round_mode="sig_fig", exp_mode="engineering", ndigits=6
+            )
             print("\nCOIL MAGNETIC PARAMETERS:")
             print("Mean Sensitivity (core) = " + ("%s [volts per tesla per hertz)]" % sform(self.results['sensitivity_mean'])))
             print("Sensitivity standard Deviation = " + ("%s" % sform(self.results['sensitivity_std'])))
@@ -248,73 +369,97 @@ class Testbench_B_Sweep():
             print("Resistance (core): %s [ohms]" % sform(self.results['Rcore']))
             print("Inductance (air): %s [henries]" % sform(self.results['Lair']))
             print("Inductance (core): %s [henries]" % sform(self.results['Lcore']))
+
+            if self.results.get('makespan'):
+                print("\nSCHEDULING:")
+                print("Makespan: %.2f [s], ideal makespan: %.2f [s] (%.0f%% efficient)" % (
+                    self.results['makespan'], self.results['makespan_ideal'], 100 * self.results['makespan_ideal'] / self.results['makespan']))
         else:
             print("No results saved, need to run simulation first.")
 
     def plot_results(self):
         if self.results is not None:
-            ## Plot the sensor response over the applied field
-            plt.figure()
-            plt.plot(self.results['B'], self.results['V'], 'bo')
-            plt.xlabel("Applied magnetic flux density magnitude [T]")
-            plt.ylabel("Voltage amplitude [V]")
-            plt.title("Sensor voltage vs applied magnetic flux density")
-            left = self.results['B'][0]
-            top = self.results['V'][-1]
-            plt.text(left, top, "Mean Sensitivity [V/(T.Hz)] = " + '%.7f' % (self.results['sensitivity_mean']))
-            plt.grid(True)
-            # ax.get_yaxis().get_major_formatter().set_useOffset(False)
-            plt.show()
-
-            # Plot the sensor sensitivity [in V/(T.Hz)] vs. the applied magnetic field
-            plt.figure()
-            plt.plot(self.results['B'], self.results['sensitivities'], 'bo')
-            plt.xlabel("Applied magnetic flux density magnitude [T]")
-            plt.ylabel("Coil sensitivity [V/(T.Hz)]")
-            plt.title("Coil sensitivity vs applied magnetic flux density")
-            plt.grid(True)
-            plt.show()
-
-            # Plot the effective core permeability vs applied magnetic field
-            plt.figure()
-            plt.plot(self.results['B'], self.results['mu_effs'], 'bo')
-            plt.xlabel("Applied magnetic flux density magnitude [T]")
-            plt.ylabel("Effective permeability")
-            plt.title("Effective permeability vs applied magnetic flux density")
-            plt.grid(True)
-            plt.show()
+            import matplotlib.pyplot as plt
+            # Plot absolute axis values rather than an offset, without changing the user's global rcParams
+            with plt.rc_context({'axes.formatter.useoffset': False}):
+                ## Plot the sensor response over the applied field
+                plt.figure()
+                plt.plot(self.results['B'], self.results['V'], 'bo')
+                plt.xlabel("Applied magnetic flux density magnitude [T]")
+                plt.ylabel("Voltage amplitude [V]")
+                plt.title("Sensor voltage vs applied magnetic flux density")
+                left = self.results['B'][0]
+                top = self.results['V'][-1]
+                plt.text(left, top, "Mean Sensitivity [V/(T.Hz)] = " + '%.7f' % (self.results['sensitivity_mean']))
+                if self.spacing == 'log':
+                    plt.xscale('log')
+                plt.grid(True)
+                # ax.get_yaxis().get_major_formatter().set_useOffset(False)
+                plt.show()
+
+                # Plot the sensor sensitivity [in V/(T.Hz)] vs. the applied magnetic field
+                plt.figure()
+                plt.plot(self.results['B'], self.results['sensitivities'], 'bo')
+                plt.xlabel("Applied magnetic flux density magnitude [T]")
+                plt.ylabel("Coil sensitivity [V/(T.Hz)]")
+                plt.title("Coil sensitivity vs applied magnetic flux density")
+                if self.spacing == 'log':
+                    plt.xscale('log')
+                plt.grid(True)
+                plt.show()
+
+                # Plot the effective core permeability vs applied magnetic field
+                plt.figure()
+                plt.plot(self.results['B'], self.results['mu_effs'], 'bo')
+                plt.xlabel("Applied magnetic flux density magnitude [T]")
+                plt.ylabel("Effective permeability")
+                plt.title("Effective permeability vs applied magnetic flux density")
+                if self.spacing == 'log':
+                    plt.xscale('log')
+                plt.grid(True)
+                plt.show()
         else:
             print("Nothing to plot, need to run simulation first.")
 
 
-def run( sen, path ):
+def refinement_scores(x, ys):
     """
-    Run method moved to module level to allow for multiprocessing 
+    Scores each interval [x[i], x[i+1]] of a sampled curve for refinement.
+    For each curve in ys the score is the largest of the change across the interval and the departure of either
+    end point from linear interpolation between its neighbours, relative to the largest magnitude of the curve.
     """
-    simulator = Magneto()
-    simulator.openfemm(True)
-
-    simulator.opendocument(path)
-
-    simulator.mi.analyze()
-    simulator.mi.loadsolution()
-    simulator.mo.zoomnatural()
-
-    simulator.mo.selectblock(sen.lacr, sen.lacz)
-    core_volume  = simulator.mo.blockintegral(10)
-    Bz_avg_vol   = simulator.mo.blockintegral(9)
-    B_Field_Core = np.abs(Bz_avg_vol/core_volume)
-
-    sensor_vals = simulator.mo.getcircuitproperties('icoil_sensor')
-    V_sensor = abs(sensor_vals[1])
-
-    result = {
-        'B'     : B_Field_Core,
-        'V'     : V_sensor,
-        'path'  : path   
-    }
-    
-    simulator.closefemm()
-    
-    return result
-
+    x = np.asarray(x, dtype=float)
+    scores = np.zeros(len(x) - 1)
+    for y in ys:
+        y = np.asarray(y, dtype=float)
+        # Points without a defined value (e.g. mu_eff at B = 0) do not drive refinement
+        if len(y) < 2 or not np.any(np.isfinite(y)) or np.nanmax(np.abs(y)) == 0:
+            continue
+        scale = np.nanmax(np.abs(y))
+        change = np.nan_to_num(np.abs(np.diff(y)) / scale)
+        # Departure of each interior point from the line between its neighbours
+        departure = np.zeros(len(y))
+        if len(y) > 2:
+            y_lin = y[:-2] + (y[2:] - y[:-2]) * (x[1:-1] - x[:-2]) / (x[2:] - x[:-2])
+            departure[1:-1] = np.nan_to_num(np.abs(y[1:-1] - y_lin) / scale)
+        scores = np.maximum(scores, np.maximum(change, np.maximum(departure[:-1], departure[1:])))
+    return scores
+
+
+def refinement_points(x, ys, refine_tol, refine_batch, max_points):
+    """
+    Returns the midpoints of the intervals of the sorted samples x most in need of refinement, highest score first.
+    Only intervals scoring above refine_tol are bisected, at most refine_batch of them
+    and no more than keep the total number of samples within max_points.
+    """
+    x = np.asarray(x, dtype=float)
+    budget = min(refine_batch, max_points - len(x))
+    if budget <= 0 or len(x) < 2:
+        return np.array([])
+    scores = refinement_scores(x, ys)
+    widths = np.diff(x)
+    intervals = [i for i in np.argsort(scores)[::-1]
+                 if scores[i] > refine_tol and widths[i] > 1e-9 * (x[-1] - x[0])]
+    intervals = np.array(intervals[:budget], dtype=int)
+
+    return (x[intervals] + x[intervals + 1]) / 2
@@ -0,0 +1,273 @@
+import concurrent.futures
+import contextlib
+import io
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+
+from .Coil import Coil
+from .Helmholtz import Helmholtz
+from .Solver import characterise
+from .Scheduler import Scheduler, HISTORY_PATH
+from .Testbenches import SIM_DEFAULTS
+from .Utility import cleanup
+
+
+# Coil parameters that can be toleranced. The core outer diameter always follows the coil inner diameter.
+PARAMETERS = ('ls', 'ids', 'ods', 'lc', 'odw', 'pf')
+
+# Each round of Latin hypercube sampling is a new, independent hypercube, which only stratifies the tolerances with
+# enough points. The default round size never falls below this, however few cores the host has.
+LHS_MIN_BATCH = 32
+
+# Metrics reported for every design, with the key of their result arrays
+METRICS = {
+    'sensitivities' : 'Sensitivity [V/(T.Hz)]',
+    'mu_effs'       : 'Effective permeability',
+    'Lair'          : 'Inductance (air) [H]',
+    'Lcore'         : 'Inductance (core) [H]',
+    'Rair'          : 'Resistance (air) [ohms]',
+    'Rcore'         : 'Resistance (core) [ohms]',
+}
+
+
+# A testbench class to perform a Monte Carlo / quasi-Monte Carlo tolerance analysis of a user defined coil design
+# Each design is evaluated at a single flux density B, so B should lie in the linear region of the core.
+class Testbench_Tolerance():
+    """
+    tolerances : dict mapping coil parameters ('ls', 'ids', 'ods', 'lc', 'odw', 'pf') to their manufacturing tolerance,
+    a +/- deviation in the units of the parameter (millimetres, or a fraction for pf)
+    distribution : 'uniform' draws parameters uniformly within the tolerance,
+    'normal' treats the tolerance as 3 standard deviations
+    sampling : 'sobol' (scrambled Sobol sequence) or 'lhs' (Latin hypercube)
+    replicates : number of independently scrambled Sobol sequences. Sobol points are not independent, so the error of the
+    mean is estimated from the spread of the replicate means (randomised quasi-Monte Carlo). Each round doubles the points
+    of every replicate to keep the balance of the sequences, so the number of designs is replicates * a power of two.
+    resolution : dict of the smallest meaningful change of each parameter, defaults to 1/20 of its tolerance.
+    Sampled designs are rounded to this resolution so that equal designs are solved only once.
+    rel_precision : the analysis stops once the confidence interval half-width of every mean is below rel_precision * mean
+    confidence : confidence level of the reported intervals. With 'lhs' the interval treats the designs as independent,
+    which overstates the error of the mean as Latin hypercube sampling has no more variance than independent sampling.
+    batch_size : designs drawn per round, each round is solved in parallel. Defaults to a power of two >= 2 * CPU cores,
+    and to at least LHS_MIN_BATCH with 'lhs' as every round is a separate Latin hypercube
+    max_samples : the analysis stops before exceeding this many designs even if the precision has not been reached
+    cache : dict of solved designs, shared between analyses to avoid repeating solves
+    history_path : file of recorded solve times used to submit the longest designs first, None keeps them in memory only
+    """
+    def __init__(self, tolerances, freq=1e3, B=1e-6, distribution='uniform', sampling='sobol', replicates=8, resolution=None,
+                 rel_precision=0.01, confidence=0.95, batch_size=None, max_samples=1024, seed=None, cache=None, history_path=HISTORY_PATH, **kwargs):
+        unknown = [k for k in tolerances if k not in PARAMETERS]
+        if unknown:
+            logging.error(f'Tolerances given for unsupported parameters: {unknown}, supported parameters are {PARAMETERS}')
+            raise ValueError('Tolerances given for unsupported parameters')
+        if sampling not in ('sobol', 'lhs'):
+            raise ValueError("sampling must be 'sobol' or 'lhs'")
+        if distribution not in ('uniform', 'normal'):
+            raise ValueError("distribution must be 'uniform' or 'normal'")
+        if sampling == 'sobol' and not 2 <= replicates <= max_samples:
+            raise ValueError('Sobol sampling requires between 2 and max_samples replicates')
+
+        self.tolerances = dict(tolerances)
+        self.freq = freq
+        self.B = B
+        self.distribution = distribution
+        self.sampling = sampling
+        self.replicates = replicates if sampling == 'sobol' else 1
+        self.resolution = {k: (resolution or {}).get(k, tol / 20) for k, tol in self.tolerances.items()}
+        self.rel_precision = rel_precision
+        self.confidence = confidence
+        if batch_size is None:
+            batch_size = 1 << int(np.ceil(np.log2(2 * (os.cpu_count() or 1))))
+            if sampling == 'lhs':
+                batch_size = max(batch_size, LHS_MIN_BATCH)
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+        self.seed = seed
+        self.cache = {} if cache is None else cache
+        self.scheduler = Scheduler(history_path)
+        # Default settings for FEMM problems
+        self.__sim_kwargs = {**{'freq' : self.freq}, **{k : kwargs.get(k, v) for k,v in SIM_DEFAULTS.items()}}
+        self.results = None
+        if not os.path.isdir("temp"):
+            os.mkdir("temp")
+
+    def analyse(self, sen, clean_up_femm=True, executor=None):
+        """
+        executor : a concurrent.futures executor used to run the solves, e.g. a pywinding.Distributed.Coordinator.
+        If None a process pool using all available CPU cores of this machine is used.
+        """
+        if executor is None:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=None) as executor:
+                return self.analyse(sen, clean_up_femm, executor)
+
+        from scipy.stats import qmc, norm, t
+
+        names = list(self.tolerances)
+        if self.sampling == 'sobol':
+            # Independent scrambles of the Sobol sequence, one per replicate
+            seeds = np.random.SeedSequence(self.seed).spawn(self.replicates)
+            samplers = [qmc.Sobol(len(names), scramble=True, seed=np.random.default_rng(s)) for s in seeds]
+        else:
+            samplers = [qmc.LatinHypercube(len(names), seed=self.seed)]
+        nominal = np.array([getattr(sen, k) for k in names])
+        tolerance = np.array([self.tolerances[k] for k in names])
+        resolution = np.array([self.resolution[k] for k in names])
+
+        print(f'TOLERANCE ANALYSIS OF {sen.na} USING {self.sampling.upper()} SAMPLING AT {self.B} T and {self.freq} Hz\n')
+        samples = np.empty((0, len(names)))
+        replicate = np.empty(0, dtype=int)
+        keys_air, keys_core = [], []
+        num_solves = 0
+        converged = False
+        self.scheduler.begin()
+        while True:
+            n = self.__draws(len(samples))
+            if n == 0:
+                break
+            u = np.vstack([sampler.random(n) for sampler in samplers])
+            if self.distribution == 'uniform':
+                x = nominal + (2 * u - 1) * tolerance
+            else:
+                x = nominal + norm.ppf(np.clip(u, 1e-9, 1 - 1e-9)) * tolerance / 3
+            # Snap the designs to the resolution grid so that equal designs share a cache entry
+            x = nominal + np.round((x - nominal) / resolution) * resolution
+
+            jobs, tasks, job_keys = [], [], {}
+            for values in x:
+                design = self.__design(sen, dict(zip(names, values)))
+                helm = Helmholtz(100 * (design.ls + design.ods), self.B, self.freq, 5, 1)
+                for sensor, keys in ((self.__air(design), keys_air), (design, keys_core)):
+                    key = self.__key(sensor)
+                    keys.append(key)
+                    if key not in self.cache and key not in job_keys:
+                        job_keys[key] = len(jobs)
+                        jobs.append((characterise, (sensor, helm, self.__sim_kwargs)))
+                        tasks.append((sensor, 'characterise', 0))
+            samples = np.vstack([samples, x])
+            replicate = np.concatenate([replicate, np.repeat(np.arange(len(samplers)), n)])
+
+            print(f"ROUND OF {len(x)} DESIGNS REQUIRES {len(jobs)} NEW SOLVES")
+            for key, result in zip(job_keys, self.scheduler.dispatch(executor, jobs, tasks, desc='Tolerance Progress')):
+                self.cache[key] = result
+            num_solves += len(jobs)
+
+            self.results = self.__statistics(sen, names, samples, replicate, keys_air, keys_core, t)
+            self.results['num_solves'] = num_solves
+            self.results['makespan'] = self.scheduler.makespan
+            self.results['makespan_ideal'] = self.scheduler.makespan_ideal
+            if len(samples) > self.replicates and all(self.results[f'{m}_halfwidth'] <= self.rel_precision * abs(self.results[f'{m}_mean'])
+                                         for m in METRICS):
+                converged = True
+                break
+
+        self.results['converged'] = converged
+        print("TOLERANCE ANALYSIS " + ("CONVERGED" if converged else "REACHED max_samples") + f" AFTER {len(samples)} DESIGNS AND {num_solves} SOLVES")
+
+        if clean_up_femm is True:
+            cleanup()
+
+        return self.results
+
+    def __draws(self, num_samples):
+        # Number of points to draw from each sampler in the next round, 0 once max_samples would be exceeded
+        if self.sampling == 'lhs':
+            return min(self.batch_size, self.max_samples - num_samples)
+        per_replicate = num_samples // self.replicates
+        if per_replicate == 0:
+            # The first round is the power of two per replicate closest to batch_size designs, within max_samples
+            per_replicate = 1 << max(0, int(np.round(np.log2(self.batch_size / self.replicates))))
+            while per_replicate > 1 and per_replicate * self.replicates > self.max_samples:
+                per_replicate //= 2
+            return per_replicate
+        # Later rounds double every replicate, keeping the number of points of each sequence a power of two
+        return per_replicate if num_samples + per_replicate * self.replicates <= self.max_samples else 0
+
+    def __design(self, sen, values):
+        # Build the coil for a sampled set of parameters, all other parameters are taken from the nominal coil
+        p = {k: getattr(sen, k) for k in PARAMETERS}
+        p.update(values)
+        p['lc'] = max(p['lc'], p['ls'])
+        # Silence the specification printout of each of the sampled coils
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Coil(p['ls'], p['ids'], p['ods'], p['lc'], sen.idc, p['ids'], p['odw'], p['pf'], sen.ma, sen.na,
+                        odwc=sen.odwc, explicit_n=sen.explicit_n)
+
+    def __air(self, sen):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Coil(sen.ls, sen.ids, sen.ods, sen.lc, sen.idc, sen.odc, sen.odw, sen.pf, 'Air', sen.na,
+                        odwc=sen.odwc, explicit_n=sen.n)
+
+    def __key(self, sen):
+        # A solved design is identified by everything that changes its FEMM problem
+        geometry = (sen.ls, sen.ids, sen.ods, sen.lc, sen.idc, sen.odw, sen.odwc, sen.n, self.B, self.freq)
+        return (sen.ma, *(float(np.round(v, 12)) for v in geometry), tuple(self.__sim_kwargs.items()))
+
+    def __statistics(self, sen, names, samples, replicate, keys_air, keys_core, t):
+        air  = [self.cache[k] for k in keys_air]
+        core = [self.cache[k] for k in keys_core]
+        B_air = np.array([r['B'] for r in air])
+        values = {
+            'sensitivities' : np.array([r['V'] for r in core]) / (B_air * self.freq),
+            'mu_effs'       : np.array([r['B'] for r in core]) / B_air,
+            'Lair'          : np.array([r['L'] for r in air]),
+            'Lcore'         : np.array([r['L'] for r in core]),
+            'Rair'          : np.array([r['R'] for r in air]),
+            'Rcore'         : np.array([r['R'] for r in core]),
+        }
+
+        n = len(samples)
+        results = {
+            'Name'          : sen.na,
+            'parameters'    : names,
+            'samples'       : samples,
+            'num_designs'   : n,
+            'replicates'    : self.replicates,
+            'confidence'    : self.confidence,
+        }
+        # Student t confidence interval of the mean, and the spread of the designs themselves.
+        # With Sobol sampling the interval is taken over the independent replicate means rather than the designs.
+        groups = self.replicates if self.sampling == 'sobol' else n
+        t_crit = t.ppf(0.5 + self.confidence / 2, groups - 1) if groups > 1 else np.inf
+        for m, v in values.items():
+            mean = np.mean(v)
+            std = np.std(v, ddof=1) if n > 1 else 0.0
+            if self.sampling == 'sobol':
+                means = np.array([np.mean(v[replicate == k]) for k in range(self.replicates)])
+                halfwidth = t_crit * np.std(means, ddof=1) / np.sqrt(self.replicates)
+            else:
+                halfwidth = t_crit * std / np.sqrt(n)
+            results.update({
+                m                   : v,
+                f'{m}_mean'         : mean,
+                f'{m}_std'          : std,
+                f'{m}_halfwidth'    : halfwidth,
+                f'{m}_ci'           : np.array([mean - halfwidth, mean + halfwidth]),
+                f'{m}_interval'     : np.percentile(v, [50 - 50 * self.confidence, 50 + 50 * self.confidence]),
+            })
+        return results
+
+    def print_results(self):
+        if self.results is not None:
+            from sciform import Formatter
+            sform = Formatter(
+                round_mode="sig_fig", exp_mode="engineering", ndigits=6
+            )
+            level = f"{100 * self.confidence:g}%"
+            print(f"\nTOLERANCE ANALYSIS OVER {self.results['num_designs']} DESIGNS ({self.results['num_solves']} SOLVES):")
+            for m, label in METRICS.items():
+                low, high = self.results[f'{m}_interval']
+                print(f"{label}: mean = {sform(self.results[f'{m}_mean'])} +/- {sform(self.results[f'{m}_halfwidth'])} ({level} CI), "
+                      f"std = {sform(self.results[f'{m}_std'])}, {level} of designs within [{sform(low)}, {sform(high)}]")
+        else:
+            print("No results saved, need to run analysis first.")
+
+    def save_results(self):
+        if self.results is not None:
+            from scipy.io import savemat
+            save_path = self.results['Name'] + f"_tolerance_T_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.mat"
+            print("\nSAVING RESULTS TO", save_path)
+            savemat(save_path, self.results)
+        else:
+            print("No results saved, need to run analysis first.")
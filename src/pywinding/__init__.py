@@ -1,7 +1,30 @@
 from .Helmholtz import Helmholtz
 from .Coil import Coil
-from .Testbenches import Testbench_B_Sweep
 from .Utility import *
 from .version import __version__
 
-__all__ = ['main', 'Testbenches.py', 'Helmholtz', 'Coil', 'Timer']
\ No newline at end of file
+# The testbenches and the coordinator are imported on first access (PEP 562) so that `import pywinding`,
+# and every pool or remote worker process that unpickles a job, stays lightweight.
+# Only names that differ from their module name can be lazy: importing a submodule binds the submodule
+# itself on the package, which would hide a lazy class of the same name.
+_LAZY = {
+    'Testbench_B_Sweep'     : '.Testbenches',
+    'Testbench_Tolerance'   : '.Tolerance',
+    'Coordinator'           : '.Distributed',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
+
+
+__all__ = ['Helmholtz', 'Coil', 'Testbench_B_Sweep', 'Testbench_Tolerance', 'Coordinator', 'Timer']
@@ -0,0 +1,173 @@
+import concurrent.futures
+import contextlib
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from pywinding import Testbench_B_Sweep, Coil
+from pywinding.Distributed import Coordinator
+
+
+# The protocol tests below run plain Python jobs (time.sleep, pow, ...) on worker processes started on localhost,
+# so they need neither FEMM nor Windows.
+
+@contextlib.contextmanager
+def cluster(num_workers, slots=1, **kwargs):
+    """
+    A coordinator with num_workers worker processes of the given slots connected to it
+    """
+    coordinator = Coordinator(**kwargs)
+    host, port = coordinator.address
+    env = {**os.environ, 'PYWINDING_AUTHKEY': coordinator.authkey.decode()}
+    workers = [subprocess.Popen([sys.executable, '-m', 'pywinding.Distributed', '--host', host, '--port', str(port), '--slots', str(slots)],
+                                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for _ in range(num_workers)]
+    try:
+        assert coordinator.wait_for_workers(num_workers, timeout=60), 'Workers failed to connect to the coordinator'
+        yield coordinator, workers
+    finally:
+        coordinator.shutdown(wait=False, cancel_futures=True)
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+            worker.wait()
+
+
+def test_results_stream_and_idle_worker_steals():
+    with cluster(2) as (coordinator, workers):
+        # Each worker runs one job and queues one more. The worker holding the long job has a short job
+        # queued behind it, which the other worker steals once it has finished its own two.
+        durations = [4, 0.2, 0.2, 0.2]
+        futures = [coordinator.submit(time.sleep, d) for d in durations]
+        completed = [futures.index(f) for f in concurrent.futures.as_completed(futures, timeout=60)]
+        assert completed[-1] == 0, f'short jobs waited behind the long one, completion order {completed}'
+        assert all(f.result() is None for f in futures)
+
+
+def test_lost_worker_jobs_are_requeued():
+    with cluster(2) as (coordinator, workers):
+        futures = [coordinator.submit(time.sleep, 1) for _ in range(4)]
+        time.sleep(0.5)
+        workers[0].kill()
+        assert [f.result(timeout=60) for f in futures] == [None] * 4
+        assert len(coordinator.workers) == 1
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGSTOP'), reason='needs SIGSTOP to freeze a worker')
+def test_silent_worker_is_dropped_after_heartbeat_timeout():
+    with cluster(2, heartbeat_timeout=4) as (coordinator, workers):
+        futures = [coordinator.submit(time.sleep, 1) for _ in range(4)]
+        # A frozen worker keeps its connection open but stops sending heartbeats
+        os.kill(workers[0].pid, signal.SIGSTOP)
+        try:
+            assert [f.result(timeout=60) for f in futures] == [None] * 4
+            assert len(coordinator.workers) == 1
+        finally:
+            os.kill(workers[0].pid, signal.SIGCONT)
+
+
+def test_failures_propagate():
+    with cluster(1, slots=2) as (coordinator, workers):
+        with pytest.raises(TypeError):
+            coordinator.submit(pow, 'a', 2).result(timeout=60)
+        # A job that kills its solver process fails alone, the worker keeps serving the jobs around it
+        running = coordinator.submit(time.sleep, 1)
+        with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+            coordinator.submit(os._exit, 1).result(timeout=60)
+        assert running.result(timeout=60) is None
+        assert [coordinator.submit(pow, 2, i).result(timeout=60) for i in range(4)] == [1, 2, 4, 8]
+
+# PyWinding MUST be called from either a function or from the Python interpreter. Do NOT call PyWinding from a script.
+# Otherwise the multiprocess code will fail and strange errors will occur.
+class RemoteExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Thread pool that the testbench treats as remote workers, like a Coordinator
+    """
+    remote = True
+
+
+def synthetic_solve(sen, helm, sim_kwargs, field_grid=None):
+    mu = 1 if sen.ma == 'Air' else 100
+    return {'B': helm.B * mu, 'V': helm.B * mu * helm.f, 'path': None, 'time': 0.01}
+
+
+def synthetic_extract_lr(sen, helm, sim_kwargs):
+    return {'R': 5.0, 'L': 1e-3 if sen.ma == 'Air' else 1e-1, 'time': 0.01}
+
+
+def test_remote_sweep_needs_no_local_femm(monkeypatch):
+    import pywinding.Testbenches
+    import pywinding.Magneto
+
+    def no_femm(*args, **kwargs):
+        raise AssertionError('FEMM started on the coordinator host')
+    monkeypatch.setattr(pywinding.Testbenches, 'Magneto', no_femm)
+    monkeypatch.setattr(pywinding.Testbenches, 'solve', synthetic_solve)
+    monkeypatch.setattr(pywinding.Testbenches, 'extract_lr', synthetic_extract_lr)
+
+    coil = Coil(6.5, 0.09, 0.5, 9, 0, 0.09, 0.025, 1, 'Hiperco-50', 'remote', odwc=0.025, explicit_n=False)
+    tb = Testbench_B_Sweep(1000, 1e-6, 3e-6, 3, history_path=None)
+    with RemoteExecutor(max_workers=2) as executor:
+        results = tb.simulate(coil, clean_up_femm=False, executor=executor)
+    assert np.allclose(results['mu_effs'], 100)
+    assert (results['Lair'], results['Lcore'], results['Rcore']) == (1e-3, 1e-1, 5.0)
+
+
+def main():
+    """
+        Runs the microcoil sweep through a coordinator with several worker processes on localhost.
+        On a cluster each worker is started on its own host with:
+            python -m pywinding.Distributed --host <coordinator host> --port <coordinator port>
+        with PYWINDING_AUTHKEY set to the key shared with the coordinator,
+        and the coordinator is created with host='0.0.0.0' so that it accepts remote connections.
+     """
+    num_workers = 3         # The number of worker processes to launch
+    slots = 2               # The number of FEMM processes each worker runs in parallel
+
+    name = 'test_distributed_microcoil'
+    ls = 6.5                    # ls  : length of the sensor coil
+    ods = 0.5                   # ods : outer diameter of the sensor coil
+    ids = 0.09                  # ids : inner diameter of the sensor coil
+    lc = 9                      # lc  : length of the magnetic core
+    odc = ids                   # idc : inner diameter of the magnetic core (typically 0)
+    idc = 0                     # odc :  outer diameter of the magnetic core (typically same as ids)
+    odw = 0.025                 # odw : outer diameter of the wire used to wind the sensor including insulation, as this is used to calculate the number of turns.
+    odwc= 0.025                 # odwc : outer diameter of the copper wire cross section only
+    pf = 1                      # pf  : The packing factor
+    ma = 'Hiperco-50'           # ma  : The core material (must be defined within the FEMM program)
+    force_n = False             # Set to False if you wish the program to deduce the number of turns based on the provded coil geometry
+
+    # Define the Flux density range for testing
+    B_start = 1e-6          # The flux density to begin the sweep
+    B_end = 5e-6            # The flux density to end the sweep
+    f_test = 1000           # The excitation frequency at which to perform analysis.
+    num_points = 10          # The number of points to use for the sweep
+
+    testcoil = Coil(ls,ids,ods,lc,idc,odc,odw,pf,ma,name, odwc=odwc, explicit_n=force_n)
+    tb = Testbench_B_Sweep(f_test, B_start, B_end, num_points)
+
+    # Start the coordinator on a free port and launch the workers against it, sharing its generated authkey
+    with Coordinator() as coordinator:
+        host, port = coordinator.address
+        env = {**os.environ, 'PYWINDING_AUTHKEY': coordinator.authkey.decode()}
+        workers = [subprocess.Popen([sys.executable, '-m', 'pywinding.Distributed', '--host', host, '--port', str(port), '--slots', str(slots)], env=env)
+                   for _ in range(num_workers)]
+        if not coordinator.wait_for_workers(num_workers, timeout=60):
+            raise RuntimeError('Workers failed to connect to the coordinator')
+
+        # The coordinator drops in as the executor of the testbench
+        results = tb.simulate(testcoil, clean_up_femm=True, executor=coordinator)
+
+    for worker in workers:
+        worker.wait()
+
+    tb.print_results()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import concurrent.futures
+import os
+import re
+
+import numpy as np
+import pytest
+
+from pywinding import Coil, Testbench_B_Sweep
+import pywinding.Testbenches
+from pywinding.Solver import field_map
+
+# Checks the batched field map sampling against a fake FEMM, and the validation of the field grid.
+
+
+def lua_string(text, start):
+    """
+    Parses the Lua string literal starting at text[start], returns its value and the index after its closing quote
+    """
+    quote = text[start]
+    escapes = {'n': '\n', '\\': '\\', '"': '"', "'": "'"}
+    value, i = '', start + 1
+    while text[i] != quote:
+        assert text[i] != '\n', 'unfinished string'
+        if text[i] == '\\':
+            value += escapes[text[i + 1]]
+            i += 2
+        else:
+            value += text[i]
+            i += 1
+    return value, i + 1
+
+
+class FakeSimulator:
+    """
+    Records the command sent to callfemm and evaluates it as FEMM would for a known field,
+    A = r + j z, B1 = 1 and B2 = j r z, with points of r > 1 outside the problem
+    """
+    def __init__(self):
+        self.commands = []
+
+    def callfemm(self, command):
+        self.commands.append(command)
+        assert command.startswith('dostring(') and command.endswith(')')
+        chunk, end = lua_string(command, len('dostring('))
+        assert end == len(command) - 1, 'text after the dostring argument'
+
+        r, z = [[float(v) for v in t.split(',')] for t in re.findall(r'\{([^}]*)\}', chunk)[:2]]
+        path = re.search(r"openfile\('([^']*)', 'w'\)", chunk).group(1)
+        # Both strings written inside the chunk must hold a newline escape rather than break the line
+        written = [lua_string(chunk, m.start())[0] for m in re.finditer(r"'(?:%|nan)", chunk)]
+        assert len(written) == 2 and all(w.endswith('\n') for w in written)
+        with open(path, 'w') as f:
+            for zi in z:
+                for rj in r:
+                    if rj > 1:
+                        f.write(written[1])
+                    else:
+                        f.write(f"{rj} 0 1 0 0 {rj * zi}\n")
+        return []
+
+
+def test_field_map_single_call(tmp_path):
+    simulator = FakeSimulator()
+    r = np.array([0, 0.5, 2])
+    z = np.linspace(-1, 1, 4)
+    path = str(tmp_path / 'problem.fem')
+    field = field_map(simulator, path, r, z)
+
+    assert len(simulator.commands) == 1
+    assert field['A'].shape == field['Br'].shape == field['Bz'].shape == field['B'].shape == (len(z), len(r))
+    inside = r <= 1
+    np.testing.assert_allclose(field['A'][:, inside], r[inside] + 0j + 0 * z[:, None])
+    np.testing.assert_allclose(field['Bz'][:, inside], 1j * np.outer(z, r[inside]))
+    np.testing.assert_allclose(field['B'][:, inside], np.sqrt(1 + np.outer(z, r[inside])**2))
+    assert np.all(np.isnan(field['B'][:, ~inside])) and np.all(np.isnan(field['A'][:, ~inside]))
+    # The output file of the chunk has been read and deleted
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('field_grid', [([-0.1, 0, 1], [0]), ([0, np.nan], [0]), ([0, 1], [0, np.inf])])
+def test_invalid_grid_rejected_before_drawing(monkeypatch, tmp_path, field_grid):
+    monkeypatch.chdir(tmp_path)
+
+    def no_femm(*args, **kwargs):
+        raise AssertionError('a problem was drawn before the field grid was checked')
+    monkeypatch.setattr(pywinding.Testbenches, 'Magneto', no_femm)
+
+    class NoExecutor(concurrent.futures.Executor):
+        def submit(self, *args, **kwargs):
+            raise AssertionError('a job was dispatched before the field grid was checked')
+
+    coil = Coil(6.5, 0.09, 0.5, 9, 0, 0.09, 0.025, 1, 'Hiperco-50', 'fieldmap', odwc=0.025, explicit_n=False)
+    tb = Testbench_B_Sweep(1000, 1e-6, 3e-6, 3, history_path=None)
+    with pytest.raises(ValueError):
+        tb.simulate(coil, clean_up_femm=False, executor=NoExecutor(), field_grid=field_grid)
+
+
+def main():
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        simulator = FakeSimulator()
+        field = field_map(simulator, os.path.join(directory, 'problem.fem'), [0, 0.5, 2], [-1, 0, 1])
+        print("Command sent to FEMM:", simulator.commands[0])
+        print("|B| [z, r]:", field['B'], sep='\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import subprocess
+import sys
+
+# Guards the start-up cost of pywinding and of the worker processes that unpickle simulation jobs.
+# Equivalent to running: python -X importtime -c "import pywinding.Solver"
+
+# Modules that must only be imported when plotting, saving, formatting or showing progress
+HEAVY_MODULES = ('matplotlib', 'scipy', 'sciform', 'tqdm', 'femm')
+
+# Generous upper bounds on the cumulative import time (microseconds), numpy dominates both
+IMPORT_BUDGET_US = {
+    'pywinding'         : 500000,
+    'pywinding.Solver'  : 1000000,
+}
+
+
+def importtime(module):
+    """
+    Imports module in a fresh interpreter with -X importtime and returns {module name: cumulative time in us}
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_time():
+    for module, budget in IMPORT_BUDGET_US.items():
+        times = importtime(module)
+        heavy = [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+        assert not heavy, f"import {module} pulled in {sorted(set(n.split('.')[0] for n in heavy))}"
+        assert times[module] < budget, f"import {module} took {times[module]} us, budget is {budget} us"
+
+
+def test_exports_are_classes():
+    # Submodules named after their class (pywinding.Coil, pywinding.Helmholtz) must not hide the class
+    code = ("import pywinding.Solver, pickle; from pywinding import Testbench_Tolerance, Coil, Helmholtz, Testbench_B_Sweep, Coordinator; "
+            "print(all(isinstance(c, type) for c in (Testbench_Tolerance, Coil, Helmholtz, Testbench_B_Sweep, Coordinator)))")
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert proc.stdout.strip() == 'True', proc.stdout + proc.stderr
+
+
+def main():
+    for module in IMPORT_BUDGET_US:
+        times = importtime(module)
+        print(f"import {module}: {times[module] / 1000:.1f} ms")
+        for name, cumulative in sorted(times.items(), key=lambda t: -t[1])[1:6]:
+            print(f"    {name}: {cumulative / 1000:.1f} ms")
+    test_import_time()
+    test_exports_are_classes()
+
+
+if __name__ == "__main__":
+    main()
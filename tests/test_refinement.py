@@ -0,0 +1,96 @@
+import numpy as np
+
+from pywinding.Testbenches import refinement_scores, refinement_points
+
+# Checks the adaptive refinement of flux density sweeps on synthetic core curves, without running FEMM.
+
+B_KNEE = 1e-3       # flux density (T) at which the synthetic core saturates
+
+
+def mu_eff(B):
+    """
+    Effective permeability of a synthetic core, flat below the knee and falling steeply above it
+    """
+    return 1 + 200 / (1 + (np.asarray(B) / B_KNEE)**3)
+
+
+def sweep(B_start=1e-7, B_end=1e-1, num_points=7, refine_tol=0.01, refine_batch=4, max_points=40):
+    """
+    Runs the adaptive refinement loop of a log spaced sweep, returns the flux densities of each round
+    """
+    rounds = [np.geomspace(B_start, B_end, num_points)]
+    Bs = rounds[0]
+    while True:
+        x_new = refinement_points(np.log(Bs), [mu_eff(Bs)], refine_tol, refine_batch, max_points)
+        if len(x_new) == 0:
+            return rounds
+        rounds.append(np.exp(x_new))
+        Bs = np.sort(np.concatenate([Bs, rounds[-1]]))
+
+
+def test_top_intervals_cover_knee():
+    Bs = np.geomspace(1e-7, 1e-1, 13)
+    scores = refinement_scores(np.log(Bs), [mu_eff(Bs)])
+    top = np.argsort(scores)[::-1][:2]
+    assert Bs[top.min()] <= B_KNEE <= Bs[top.max() + 1], f'top intervals {Bs[top]} miss the knee'
+    # Far below the knee the curve is flat and needs no refinement
+    assert np.all(scores[Bs[1:] < B_KNEE / 100] < 0.01)
+
+
+def test_linear_curve_has_no_departure():
+    x = np.linspace(0, 1, 11)
+    y = 3 * x + 2
+    # Only the change across each interval remains, the departure from linear interpolation is zero
+    scores = refinement_scores(x, [y])
+    np.testing.assert_allclose(scores, np.abs(np.diff(y)) / np.max(np.abs(y)), atol=1e-12)
+    # A curve departing from the line at one point is scored above the change on both sides of that point
+    y[5] += 1
+    bumped = refinement_scores(x, [y])
+    assert bumped[4] > scores[4] and bumped[5] > scores[5]
+
+
+def test_budget_limits():
+    rounds = sweep(refine_batch=4, max_points=40)
+    assert len(rounds) > 2, 'the knee was not refined'
+    assert all(len(Bs) <= 4 for Bs in rounds[1:])
+    assert sum(len(Bs) for Bs in rounds) <= 40
+
+    rounds = sweep(refine_batch=8, max_points=12)
+    assert sum(len(Bs) for Bs in rounds) == 12
+    assert len(refinement_points(np.log(np.geomspace(1e-7, 1e-1, 12)), [mu_eff(np.geomspace(1e-7, 1e-1, 12))], 0.01, 8, 12)) == 0
+
+
+def test_refined_points_concentrate_at_knee():
+    Bs = np.concatenate(sweep(max_points=40))
+    decades = np.log10(Bs / B_KNEE)
+    near = np.sum(np.abs(decades) <= 1)
+    far = np.sum(decades < -2)
+    assert near > far, f'{near} points within a decade of the knee, {far} points more than two decades below it'
+
+
+def test_undefined_values_are_ignored():
+    # mu_eff = B_core / B_air is NaN at B = 0 in a linear sweep starting from zero
+    Bs = np.linspace(0, 5e-3, 11)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = mu_eff(Bs) * Bs / Bs
+    assert np.isnan(mu[0])
+    scores = refinement_scores(Bs, [mu])
+    assert np.all(np.isfinite(scores))
+    assert np.argmax(scores) > 0
+    assert np.all(refinement_scores(Bs, [np.full(len(Bs), np.nan)]) == 0)
+    x_new = refinement_points(Bs, [mu], 0.01, 4, 40)
+    assert 0 < len(x_new) <= 4 and np.all(np.isfinite(x_new))
+
+
+def main():
+    for Bs in sweep():
+        print("Round of %d points: %s" % (len(Bs), np.array2string(np.sort(Bs), formatter={'float': '{:.2e}'.format})))
+    test_top_intervals_cover_knee()
+    test_linear_curve_has_no_departure()
+    test_budget_limits()
+    test_refined_points_concentrate_at_knee()
+    test_undefined_values_are_ignored()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import concurrent.futures
+import threading
+import time
+
+import numpy as np
+
+from pywinding import Coil
+from pywinding.Scheduler import Scheduler
+
+# Checks the cost model and longest-first dispatch of the scheduler with plain Python jobs, without running FEMM.
+
+
+class RecordingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Thread pool that records the order in which jobs are submitted
+    """
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.submitted = []
+        self.__lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self.__lock:
+            self.submitted.append(args[0])
+        return super().submit(fn, *args, **kwargs)
+
+
+def job(index, seconds):
+    # Stands in for a solve, reporting seconds as the time it took as the solve functions do
+    time.sleep(0.01)
+    return {'index': index, 'time': seconds}
+
+
+def coils():
+    """
+    Coils of increasing predicted cost: air and permeable cores, coarse and fine wire
+    """
+    return [
+        Coil(6.5, 0.09, 0.5, 9, 0, 0.09, 0.025, 1, 'Air', 'air_coarse', odwc=0.025, explicit_n=False),
+        Coil(6.5, 0.09, 0.5, 9, 0, 0.09, 0.005, 1, 'Air', 'air_fine', odwc=0.005, explicit_n=False),
+        Coil(6.5, 0.09, 0.5, 9, 0, 0.09, 0.025, 1, 'Hiperco-50', 'core_coarse', odwc=0.025, explicit_n=False),
+        Coil(6.5, 0.09, 0.5, 9, 0, 0.09, 0.005, 1, 'Hiperco-50', 'core_fine', odwc=0.005, explicit_n=False),
+    ]
+
+
+def test_longest_first_and_original_order():
+    scheduler = Scheduler(history_path=None)
+    sensors = coils()
+    tasks = [(sen, kind, 0) for sen in sensors for kind in ('run', 'characterise')]
+    costs = [scheduler.predict(*task) for task in tasks]
+    # A permeable core, finer wire and L/R extraction each make a solve longer
+    assert costs[0] < costs[2] < costs[6] and costs[0] < costs[4] and costs[0] < costs[1]
+
+    jobs = [(job, (i, 1.0)) for i in range(len(tasks))]
+    with RecordingExecutor(max_workers=2) as executor:
+        results = scheduler.dispatch(executor, jobs, tasks)
+    assert executor.submitted == sorted(range(len(tasks)), key=lambda i: -costs[i])
+    assert [r['index'] for r in results] == list(range(len(tasks)))
+
+
+def test_ideal_makespan():
+    scheduler = Scheduler(history_path=None)
+    sensors = coils()
+    tasks = [(sen, 'run', 0) for sen in sensors]
+    workers = 2
+    for times in ([1.0, 2.0, 3.0, 4.0], [0.5, 0.5, 0.5, 6.0]):
+        scheduler.begin()
+        jobs = [(job, (i, t)) for i, t in enumerate(times)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            scheduler.dispatch(executor, jobs, tasks)
+        assert np.isclose(scheduler.makespan_ideal, max(sum(times) / workers, max(times)))
+        assert scheduler.makespan > 0
+
+    # Makespans accumulate over the dispatches of a run
+    scheduler.begin()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for times in ([1.0, 2.0, 3.0, 4.0], [0.5, 0.5, 0.5, 6.0]):
+            scheduler.dispatch(executor, [(job, (i, t)) for i, t in enumerate(times)], tasks)
+    assert np.isclose(scheduler.makespan_ideal, 5.0 + 6.0)
+
+
+def test_history_updates_predictions():
+    sensors = coils()
+    for factor in (10.0, 0.1):
+        scheduler = Scheduler(history_path=None)
+        before = [scheduler.predict(sen) for sen in sensors]
+        # Every solve takes factor times longer than predicted
+        jobs = [(job, (i, factor * before[i])) for i in range(len(sensors))]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            for _ in range(5):
+                scheduler.dispatch(executor, jobs, [(sen, 'run', 0) for sen in sensors])
+        after = [scheduler.predict(sen) for sen in sensors]
+        if factor > 1:
+            assert all(a > b for a, b in zip(after, before)), f'{after} not above {before}'
+        else:
+            assert all(a < b for a, b in zip(after, before)), f'{after} not below {before}'
+        assert len(scheduler.history) == 5 * len(sensors)
+
+
+def main():
+    scheduler = Scheduler(history_path=None)
+    for sen in coils():
+        print(f"{sen.na}: predicted solve {scheduler.predict(sen):.2f} s, with L/R extraction {scheduler.predict(sen, 'characterise'):.2f} s")
+    test_longest_first_and_original_order()
+    test_ideal_makespan()
+    test_history_updates_predictions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import concurrent.futures
+import re
+
+import numpy as np
+
+from pywinding import Testbench_Tolerance, Coil
+import pywinding.Tolerance
+
+# The tests below replace the FEMM solve of each design with a synthetic response, so they run without FEMM.
+
+def synthetic_characterise(sen, helm, sim_kwargs):
+    """
+    Stands in for Solver.characterise, a smooth response of each design to its geometry
+    """
+    synthetic_characterise.calls += 1
+    mu = 1 if sen.ma == 'Air' else 50 * (sen.lc / sen.ids)**0.1
+    return {
+        'B'     : helm.B * mu,
+        'V'     : sen.n * helm.B * mu * sen.ids**2 * helm.f,
+        'R'     : sen.n * 0.01 / sen.odw**2,
+        'L'     : sen.n**2 * 1e-9 * mu,
+        'path'  : None,
+        'time'  : 0.01,
+    }
+
+
+def analyse(monkeypatch, tmp_path, **kwargs):
+    """
+    Runs a tolerance analysis of the synthetic coil, returns the testbench and its results
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pywinding.Tolerance, 'characterise', synthetic_characterise)
+    synthetic_characterise.calls = 0
+    coil = Coil(6.5, 0.09, 0.5, 9, 0, 0.09, 0.025, 1, 'Hiperco-50', 'tolerance', odwc=0.025, explicit_n=False)
+    kwargs = {'seed': 1, 'history_path': None, **kwargs}
+    tb = Testbench_Tolerance({'odw': 0.001, 'ids': 0.005, 'lc': 0.2}, **kwargs)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = tb.analyse(coil, clean_up_femm=False, executor=executor)
+    return tb, coil, results
+
+
+def test_sobol_design_counts(monkeypatch, tmp_path):
+    tb, coil, results = analyse(monkeypatch, tmp_path, replicates=4, batch_size=16, max_samples=200, rel_precision=1e-9)
+    n = results['num_designs']
+    assert not results['converged']
+    assert n <= 200 and n % 4 == 0
+    per_replicate = n // 4
+    assert per_replicate & (per_replicate - 1) == 0, f'{per_replicate} points per replicate is not a power of two'
+    assert n == 128
+
+
+def test_stops_at_requested_precision(monkeypatch, tmp_path, capsys):
+    tb, coil, results = analyse(monkeypatch, tmp_path, replicates=8, batch_size=16, rel_precision=0.01)
+    assert results['converged']
+    for m in pywinding.Tolerance.METRICS:
+        assert results[f'{m}_halfwidth'] <= 0.01 * abs(results[f'{m}_mean'])
+    # The analysis stopped as soon as the precision was reached, well before max_samples
+    rounds = [int(n) for n in re.findall(r'ROUND OF (\d+) DESIGNS', capsys.readouterr().out)]
+    assert sum(rounds) == results['num_designs'] < 1024
+
+
+def test_repeated_analysis_is_cached(monkeypatch, tmp_path):
+    tb, coil, results = analyse(monkeypatch, tmp_path, batch_size=16, max_samples=64, rel_precision=1e-9)
+    assert results['num_solves'] == synthetic_characterise.calls > 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        again = tb.analyse(coil, clean_up_femm=False, executor=executor)
+    assert again['num_solves'] == 0 and synthetic_characterise.calls == results['num_solves']
+    assert np.array_equal(again['samples'], results['samples'])
+    assert again['sensitivities_mean'] == results['sensitivities_mean']
+
+
+def test_lhs_rounds(monkeypatch, tmp_path, capsys):
+    tb, coil, results = analyse(monkeypatch, tmp_path, sampling='lhs', batch_size=8, max_samples=44, rel_precision=1e-9)
+    rounds = [int(n) for n in re.findall(r'ROUND OF (\d+) DESIGNS', capsys.readouterr().out)]
+    assert rounds == [8, 8, 8, 8, 8, 4]
+    assert results['num_designs'] == 44
+
+    # The default round size does not shrink with the core count
+    monkeypatch.setattr(pywinding.Tolerance.os, 'cpu_count', lambda: 1)
+    assert Testbench_Tolerance({'odw': 0.001}, sampling='lhs', history_path=None).batch_size >= pywinding.Tolerance.LHS_MIN_BATCH
+
+
+# PyWinding MUST be called from either a function or from the Python interpreter. Do NOT call PyWinding from a script.
+# Otherwise the multiprocess code will fail and strange errors will occur.
+def main():
+    """
+        Tolerance analysis of the microcoil design, all dimensions in millimetres
+        tolerances : the +/- manufacturing tolerance of each parameter that varies between built coils
+     """
+
+    name = 'test_microcoil'
+    ls = 6.5                    # ls  : length of the sensor coil
+    ods = 0.5                   # ods : outer diameter of the sensor coil
+    ids = 0.09                  # ids : inner diameter of the sensor coil
+    lc = 9                      # lc  : length of the magnetic core
+    odc = ids                   # idc : inner diameter of the magnetic core (typically 0)
+    idc = 0                     # odc :  outer diameter of the magnetic core (typically same as ids)
+    odw = 0.025                 # odw : outer diameter of the wire used to wind the sensor including insulation, as this is used to calculate the number of turns.
+    odwc= 0.025                 # odwc : outer diameter of the copper wire cross section only
+    pf = 1                      # pf  : The packing factor
+    ma = 'Hiperco-50'           # ma  : The core material (must be defined within the FEMM program)
+    force_n = 2000              # Fix the number of turns, as set by the winding machine
+
+    tolerances = {
+        'odw'   : 0.001,        # wire diameter
+        'ids'   : 0.005,        # core/bobbin diameter
+        'ods'   : 0.02,         # outer diameter of the winding
+        'lc'    : 0.1,          # core length
+    }
+
+    f_test = 1000           # The excitation frequency at which to perform analysis.
+    B_test = 1e-6           # The flux density at which each design is evaluated (in the linear region of the core)
+
+    testcoil = Coil(ls,ids,ods,lc,idc,odc,odw,pf,ma,name, odwc=odwc, explicit_n=force_n)
+
+    # Draw designs from a scrambled Sobol sequence until the means are known to within 1% at 95% confidence
+    tb = Testbench_Tolerance(tolerances, f_test, B_test, sampling='sobol', rel_precision=0.01, confidence=0.95, max_samples=256)
+
+    results = tb.analyse(testcoil, clean_up_femm=True)
+
+    # Print the distributions of the key results to the console
+    tb.print_results()
+
+    # Save the sampled designs and their results to a .mat file for further analysis
+    tb.save_results()
+
+
+if __name__ == "__main__":
+    main()